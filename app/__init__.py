@@ -13,6 +13,18 @@ def create_app(test_config=None):
     app.config.from_mapping(
         SECRET_KEY=os.environ.get('FLASK_SECRET_KEY', 'dev'),
         DATABASE=os.path.join(app.instance_path, 'expenses.db'),
+        # SQLite pragma set: 'durable', 'ssd' or 'sd-card' (see app/db.py)
+        DB_PROFILE=os.environ.get('DB_PROFILE', 'durable'),
+        # Largest single attachment, and total attachment bytes per user (0 = no limit)
+        ATTACHMENT_MAX_SIZE=10 * 1024 * 1024,
+        ATTACHMENT_QUOTA=int(os.environ.get('ATTACHMENT_QUOTA_MB', 500)) * 1024 * 1024,
+        # Let a front proxy send attachment files: 'x-accel' (nginx), 'x-sendfile' or unset
+        ATTACHMENT_SENDFILE=os.environ.get('ATTACHMENT_SENDFILE') or None,
+        ATTACHMENT_ACCEL_PREFIX=os.environ.get('ATTACHMENT_ACCEL_PREFIX', '/protected-uploads/'),
+        # Seconds between background `gc-attachments --delete` runs; 0 turns them off
+        ATTACHMENT_GC_INTERVAL=int(os.environ.get('ATTACHMENT_GC_INTERVAL_HOURS', 24)) * 3600,
+        # Background job threads in each web worker; 0 when `flask worker` runs them instead
+        JOB_WORKER_THREADS=int(os.environ.get('JOB_WORKER_THREADS', 1)),
         PERMANENT_SESSION_LIFETIME=dt.timedelta(minutes=15)
     )
 
@@ -32,7 +44,7 @@ def create_app(test_config=None):
     # Upload folder setup
     # We want uploads to be in the project root, not inside app/
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    UPLOAD_FOLDER = os.path.join(base_dir, 'uploads')
+    UPLOAD_FOLDER = app.config.get('UPLOAD_FOLDER') or os.path.join(base_dir, 'uploads')
     
     if not os.path.exists(UPLOAD_FOLDER):
         os.makedirs(UPLOAD_FOLDER)
@@ -40,12 +52,20 @@ def create_app(test_config=None):
     app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
     app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB
 
+    # Files written by background exports, kept out of the web root
+    app.config.setdefault('EXPORT_FOLDER', os.path.join(app.instance_path, 'exports'))
+    os.makedirs(app.config['EXPORT_FOLDER'], exist_ok=True)
+
     # Initialize extensions
-    from . import db
+    from . import db, writer, jobs, attachments, previews
     db.init_app(app)
+    writer.init_app(app)
+    jobs.init_app(app)
+    attachments.init_app(app)
+    previews.init_app(app)
 
     # Register blueprints
-    from .routes import auth, main, transactions, categories, notes, reminders, calendar
+    from .routes import auth, main, transactions, categories, notes, reminders, calendar, imports, exports, analytics
     app.register_blueprint(auth.bp)
     app.register_blueprint(main.bp)
     app.register_blueprint(transactions.bp)
@@ -53,5 +73,8 @@ def create_app(test_config=None):
     app.register_blueprint(notes.bp)
     app.register_blueprint(reminders.bp)
     app.register_blueprint(calendar.bp)
+    app.register_blueprint(imports.bp)
+    app.register_blueprint(exports.bp)
+    app.register_blueprint(analytics.bp)
 
     return app
@@ -0,0 +1,469 @@
+import os
+import re
+import time
+import hashlib
+import mimetypes
+import tempfile
+import click
+from collections import namedtuple
+from urllib.parse import quote
+from functools import wraps
+from flask import current_app, g, jsonify, request, session, send_file, Request
+from flask.cli import with_appcontext
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import FormDataParser, MultiPartParser
+from app.db import get_db
+from app.writer import run_write
+from app.jobs import job, every
+
+# Attachments are stored once per distinct content under the SHA-256 of
+# their bytes, sharded as ab/cd/<digest> so no directory grows past a few
+# entries even with 100k+ files. transactions.attachment_path holds that
+# relative path; attachment_refs counts the rows pointing at each file
+# (kept by triggers, see app/db.py) so a file is only unlinked when the
+# last transaction referencing it lets go.
+#
+# Views marked with @streamed_upload have their file parts written
+# straight to a temporary file in the upload folder while the request
+# body is parsed, hashed and size-checked chunk by chunk, so an upload
+# costs a few KB of memory however large it is.
+
+HASH_CHUNK_SIZE = 64 * 1024
+# Read size for multipart bodies on streamed views
+UPLOAD_CHUNK_SIZE = 8 * 1024
+SNIFF_BYTES = 512
+
+# An upload copied into the upload folder, not yet moved into the store.
+# Paths are resolved up front because the move runs on the writer thread.
+StagedUpload = namedtuple('StagedUpload', 'temp_path final_path store_path size')
+
+# Leading bytes of each allowed file type; the extension must agree
+_SIGNATURES = (
+    (b'%PDF-', 'pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'PK\x03\x04', 'zip'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'ole'),
+)
+# 'BM' alone starts plenty of text files; a bitmap also has one of these
+# DIB header sizes at offset 14
+_BMP_HEADER_SIZES = (12, 40, 52, 56, 64, 108, 124)
+EXTENSION_KINDS = {
+    'pdf': 'pdf', 'png': 'png', 'jpg': 'jpeg', 'jpeg': 'jpeg', 'gif': 'gif', 'bmp': 'bmp',
+    'docx': 'zip', 'xlsx': 'zip', 'doc': 'ole', 'xls': 'ole', 'txt': 'text',
+}
+
+def _upload_folder():
+    return current_app.config['UPLOAD_FOLDER']
+
+def _tmp_dir():
+    # Inside the upload folder so moving a file into place later is an
+    # atomic rename on the same filesystem
+    tmp_dir = os.path.join(_upload_folder(), 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    return tmp_dir
+
+def blob_path(digest):
+    """Relative store path for a SHA-256 hex digest"""
+    return os.path.join(digest[:2], digest[2:4], digest)
+
+# Rendered previews live next to their original (see app/previews.py)
+PREVIEW_SUFFIX = '.thumb.jpg'
+
+_DIGEST_PATH = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.thumb\.jpg)?$')
+
+# gc-attachments checks this many files against the database at a time
+GC_BATCH_SIZE = 500
+# Files younger than this are left alone: an upload may still be between
+# its temporary file and its transaction row
+GC_GRACE_PERIOD = 3600
+
+# Content-addressed files never change, so browsers may keep them for good
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+def sniff_kind(head):
+    """File kind from its first bytes, or None when unrecognized"""
+    for signature, kind in _SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if head.startswith(b'BM') and int.from_bytes(head[14:18], 'little') in _BMP_HEADER_SIZES:
+        return 'bmp'
+    # An empty file counts as (empty) text
+    if b'\x00' not in head:
+        return 'text'
+    return None
+
+def upload_limit(user_id):
+    """Bytes user_id may still upload in one file, or None for no limit"""
+    limit = current_app.config.get('ATTACHMENT_MAX_SIZE')
+    quota = current_app.config.get('ATTACHMENT_QUOTA')
+    if quota:
+        # Answered from the partial idx_transactions_attachment_usage index
+        # alone, which holds only rows with an attachment; SUM skips NULLs
+        # anyway, so the condition changes nothing else
+        used = get_db().execute('''SELECT COALESCE(SUM(attachment_size), 0) FROM transactions
+                                   WHERE user_id = ? AND attachment_size IS NOT NULL''',
+                                (user_id,)).fetchone()[0]
+        remaining = max(quota - used, 0)
+        limit = remaining if limit is None else min(limit, remaining)
+    return limit
+
+class _StreamedUpload:
+    """Writable temp file the form parser streams one upload into"""
+
+    def __init__(self, limit):
+        fd, self.temp_path = tempfile.mkstemp(dir=_tmp_dir())
+        self.file = os.fdopen(fd, 'w+b')
+        self.digest = hashlib.sha256()
+        self.head = b''
+        self.size = 0
+        self.limit = limit
+        g.setdefault('streamed_uploads', []).append(self.temp_path)
+
+    def write(self, data):
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            self.file.close()
+            discard_staged(self.temp_path)
+            raise RequestEntityTooLarge('Attachment exceeds the upload size limit')
+        if len(self.head) < SNIFF_BYTES:
+            self.head += data[:SNIFF_BYTES - len(self.head)]
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        # read/seek/close etc. for FileStorage go to the temp file
+        return getattr(self.file, name)
+
+class _StreamingFormDataParser(FormDataParser):
+    def _parse_multipart(self, stream, mimetype, content_length, options):
+        parser = MultiPartParser(
+            stream_factory=self.stream_factory,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.cls,
+            buffer_size=UPLOAD_CHUNK_SIZE,
+        )
+        boundary = options.get('boundary', '').encode('ascii')
+        if not boundary:
+            raise ValueError('Missing boundary')
+        form, files = parser.parse(stream, boundary, content_length)
+        return stream, form, files
+
+class UploadRequest(Request):
+    """Request that streams file parts into the store on @streamed_upload views"""
+
+    form_data_parser_class = _StreamingFormDataParser
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not g.get('streamed_upload'):
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return _StreamedUpload(upload_limit(session.get('user_id')))
+
+def streamed_upload(f):
+    """Stream this view's file uploads to disk, hashing and size-checking as they arrive"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.streamed_upload = True
+        # Parse the body here so an oversized upload is answered with 413
+        # before the view runs
+        request.files
+        return f(*args, **kwargs)
+    return decorated_function
+
+def stage_upload(file):
+    """Hash an upload into a temporary file and check its type, returning a StagedUpload
+
+    Raises ValueError when the content does not match the file extension.
+    """
+    stream = file.stream
+    if isinstance(stream, _StreamedUpload):
+        # Already on disk and hashed while the body was parsed
+        stream.file.flush()
+        os.fsync(stream.file.fileno())
+        stream.file.close()
+        temp_path, digest, head, size = stream.temp_path, stream.digest, stream.head, stream.size
+    else:
+        limit = upload_limit(session.get('user_id'))
+        digest = hashlib.sha256()
+        head = b''
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=_tmp_dir())
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+                    size += len(chunk)
+                    if limit is not None and size > limit:
+                        raise ValueError('Attachment exceeds the upload size limit')
+                    if len(head) < SNIFF_BYTES:
+                        head += chunk[:SNIFF_BYTES - len(head)]
+                    digest.update(chunk)
+                    out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+        except Exception:
+            discard_staged(temp_path)
+            raise
+
+    extension = file.filename.rsplit('.', 1)[-1].lower()
+    if sniff_kind(head) != EXTENSION_KINDS.get(extension):
+        discard_staged(temp_path)
+        raise ValueError(f'File content does not match its .{extension} extension')
+
+    store_path = blob_path(digest.hexdigest())
+    return StagedUpload(temp_path, os.path.join(_upload_folder(), store_path), store_path, size)
+
+def commit_staged(staged):
+    """Move a staged upload into the store, keeping any identical copy already there
+
+    Call from inside a write (run_write) so it is serialized with release().
+    """
+    if os.path.exists(staged.final_path):
+        os.remove(staged.temp_path)
+        return
+    os.makedirs(os.path.dirname(staged.final_path), exist_ok=True)
+    os.replace(staged.temp_path, staged.final_path)
+
+def discard_staged(temp_path):
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+def release(store_paths):
+    """Queue unlinking of stored files once no transaction references them"""
+    store_paths = [path for path in store_paths if path]
+    if store_paths:
+        release_files.enqueue(store_paths)
+
+@job()
+def release_files(store_paths):
+    """Unlink stored files that no transaction references any more"""
+    folder = _upload_folder()
+
+    # Runs through the writer so a concurrent upload of the same content
+    # either sees its reference counted here or re-creates the file after
+    def _release(conn):
+        removed = []
+        for path in store_paths:
+            deleted = conn.execute('DELETE FROM attachment_refs WHERE path = ? AND refcount <= 0',
+                                   (path,)).rowcount
+            if not deleted:
+                continue
+            try:
+                os.remove(os.path.join(folder, path))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error deleting file: {e}")
+                continue
+            try:
+                os.remove(os.path.join(folder, path + PREVIEW_SUFFIX))
+            except OSError:
+                pass
+            removed.append(path)
+        return removed
+
+    return run_write(_release)
+
+def _scan_store(folder, now):
+    """Yield (store path, size) for every file under folder old enough to collect"""
+    stack = ['']
+    while stack:
+        relative = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(folder, relative))
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                path = os.path.join(relative, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    if now - stat.st_mtime >= GC_GRACE_PERIOD:
+                        yield path, stat.st_size
+
+def _batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _preview_owner(path):
+    # A preview is kept exactly as long as its original
+    return path[:-len(PREVIEW_SUFFIX)] if path.endswith(PREVIEW_SUFFIX) else path
+
+def _referenced(conn, paths):
+    placeholders = ', '.join('?' * len(paths))
+    return {row[0] for row in conn.execute(
+        f'SELECT DISTINCT attachment_path FROM transactions WHERE attachment_path IN ({placeholders})', paths)}
+
+# Also queued every ATTACHMENT_GC_INTERVAL seconds with delete=True; the
+# next run comes soon enough that a failed one is not retried
+@job(max_attempts=1)
+def collect_garbage(delete=False):
+    """Find, and with delete=True remove, attachment files and references that lost their other half
+
+    Files in the upload folder that no transaction points at are orphans;
+    anything left in tmp/ is an upload that was never claimed. Transactions
+    pointing at a missing file are dangling and get their attachment
+    cleared. Everything is handled GC_BATCH_SIZE at a time so memory stays
+    flat however many files there are. Returns counts for the report.
+    """
+    folder = _upload_folder()
+    tmp_prefix = 'tmp' + os.sep
+    report = {'scanned': 0, 'orphans': 0, 'orphan_bytes': 0, 'dangling': 0, 'unused_refs': 0}
+
+    def _remove(path):
+        try:
+            os.remove(os.path.join(folder, path))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error deleting file: {e}")
+
+    for batch in _batched(_scan_store(folder, time.time()), GC_BATCH_SIZE):
+        report['scanned'] += len(batch)
+
+        def _find_orphans(conn, batch=batch):
+            stored = [(path, size) for path, size in batch if not path.startswith(tmp_prefix)]
+            referenced = _referenced(conn, sorted({_preview_owner(path) for path, size in stored})) if stored else set()
+            orphans = [(path, size) for path, size in batch
+                       if path.startswith(tmp_prefix) or _preview_owner(path) not in referenced]
+            if delete:
+                # Unlinked inside the write so an upload of the same content
+                # cannot commit a new reference to a file being removed
+                for path, size in orphans:
+                    _remove(path)
+            return orphans
+
+        orphans = run_write(_find_orphans) if delete else _find_orphans(get_db())
+        for path, size in orphans:
+            print(f"Orphaned attachment file: {path} ({size} bytes)")
+        report['orphans'] += len(orphans)
+        report['orphan_bytes'] += sum(size for path, size in orphans)
+
+    # Referenced paths in order, one batch at a time, checked against the disk
+    db = get_db()
+    last_path = ''
+    while True:
+        paths = [row[0] for row in db.execute(
+            'SELECT DISTINCT attachment_path FROM transactions '
+            'WHERE attachment_path > ? ORDER BY attachment_path LIMIT ?', (last_path, GC_BATCH_SIZE))]
+        if not paths:
+            break
+        last_path = paths[-1]
+        missing = [path for path in paths if not os.path.exists(os.path.join(folder, path))]
+        if not missing:
+            continue
+        for path in missing:
+            print(f"Missing attachment file: {path}")
+        placeholders = ', '.join('?' * len(missing))
+        if delete:
+            # Cleared like delete_attachment does, so the UI drops its 📎 badge
+            report['dangling'] += run_write(lambda conn: conn.execute(
+                f'''UPDATE transactions SET attachment_filename = NULL, attachment_path = NULL,
+                                            attachment_size = NULL
+                    WHERE attachment_path IN ({placeholders})''', missing).rowcount)
+        else:
+            report['dangling'] += db.execute(
+                f'SELECT COUNT(*) FROM transactions WHERE attachment_path IN ({placeholders})', missing).fetchone()[0]
+
+    # Names left behind by earlier runs, which cleared only the path
+    stale_names = 'attachment_path IS NULL AND attachment_filename IS NOT NULL'
+    if delete:
+        report['dangling'] += run_write(lambda conn: conn.execute(
+            f'UPDATE transactions SET attachment_filename = NULL WHERE {stale_names}').rowcount)
+    else:
+        report['dangling'] += db.execute(f'SELECT COUNT(*) FROM transactions WHERE {stale_names}').fetchone()[0]
+
+    # Counts left at zero by the triggers once nothing references a path
+    if delete:
+        report['unused_refs'] = run_write(
+            lambda conn: conn.execute('DELETE FROM attachment_refs WHERE refcount <= 0').rowcount)
+    else:
+        report['unused_refs'] = db.execute('SELECT COUNT(*) FROM attachment_refs WHERE refcount <= 0').fetchone()[0]
+    return report
+
+def send_attachment(store_path, download_name):
+    """Response serving a stored file; the caller has already authorized it
+
+    With ATTACHMENT_SENDFILE set to 'x-accel' (nginx) or 'x-sendfile'
+    (Apache, lighttpd) the front proxy streams the file and the worker is
+    free at once. Otherwise the file is sent from here with Range support.
+    """
+    file_path = os.path.join(_upload_folder(), store_path)
+    match = _DIGEST_PATH.match(store_path.replace(os.sep, '/'))
+    # The digest (plus suffix for a preview) is a strong validator for
+    # content-addressed files; files from before the store fall back to
+    # werkzeug's mtime/size ETag
+    etag = os.path.basename(store_path) if match else True
+
+    if match and etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    mode = current_app.config.get('ATTACHMENT_SENDFILE')
+    if mode in ('x-accel', 'x-sendfile'):
+        response = current_app.response_class(
+            mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream')
+        if mode == 'x-accel':
+            prefix = current_app.config.get('ATTACHMENT_ACCEL_PREFIX', '/protected-uploads/')
+            response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + store_path.replace(os.sep, '/')
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(file_path)
+        try:
+            download_name.encode('ascii')
+            response.headers.set('Content-Disposition', 'inline', filename=download_name)
+        except UnicodeEncodeError:
+            response.headers.set('Content-Disposition', 'inline',
+                                 filename=download_name.encode('ascii', 'replace').decode('ascii'),
+                                 **{'filename*': f"UTF-8''{quote(download_name)}"})
+        if match:
+            response.set_etag(etag)
+    else:
+        response = send_file(file_path, download_name=download_name, conditional=True, etag=etag)
+
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if match else 'private, no-cache'
+    return response
+
+def _discard_unclaimed(e=None):
+    # Streamed files the view never moved into the store (rejected
+    # request, disallowed extension, failed write)
+    for temp_path in g.pop('streamed_uploads', ()):
+        discard_staged(temp_path)
+
+def _too_large(e):
+    return jsonify({'error': e.description}), 413
+
+@click.command('gc-attachments')
+@click.option('--delete', is_flag=True, help='Remove orphans and clear dangling references instead of only reporting them.')
+@with_appcontext
+def gc_attachments_command(delete):
+    """Find attachment files no transaction uses, and references to missing files."""
+    report = collect_garbage(delete=delete)
+    action = 'Removed' if delete else 'Found'
+    click.echo(f"Scanned {report['scanned']} files. {action} {report['orphans']} orphaned files "
+               f"({report['orphan_bytes']} bytes), {report['dangling']} dangling references "
+               f"and {report['unused_refs']} unused reference counts.")
+    if not delete and (report['orphans'] or report['dangling'] or report['unused_refs']):
+        click.echo('Run again with --delete to clean up.')
+
+def init_app(app):
+    app.request_class = UploadRequest
+    app.cli.add_command(gc_attachments_command)
+    interval = app.config.get('ATTACHMENT_GC_INTERVAL')
+    if interval:
+        every(app, interval, collect_garbage.job_name, kwargs={'delete': True})
+    app.teardown_request(_discard_unclaimed)
+    app.register_error_handler(RequestEntityTooLarge, _too_large)
@@ -0,0 +1,35 @@
+import threading
+from flask import current_app
+from app.db import get_data_versions
+
+# Per-worker copy of the categories table, keyed by database path. Admin
+# changes bump the shared 'categories' counter in data_versions, so every
+# gunicorn worker notices them on its next lookup without re-reading rows.
+_category_cache = {}
+_category_lock = threading.Lock()
+
+def get_categories_cached(db):
+    """All categories ordered by type and name, reloaded only when they change"""
+    database = current_app.config['DATABASE']
+    version = get_data_versions(db, ('categories',))[0]
+
+    cached = _category_cache.get(database)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with _category_lock:
+        cached = _category_cache.get(database)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        rows = [dict(row) for row in db.execute('SELECT * FROM categories ORDER BY type, name')]
+        _category_cache[database] = (version, rows)
+        return rows
+
+def category_ids(db, trans_type=None):
+    """Category name to id, optionally limited to one transaction type"""
+    return {cat['name']: cat['id'] for cat in get_categories_cached(db)
+            if trans_type is None or cat['type'] == trans_type}
+
+def category_labels(db):
+    """Category id to name, for turning stored ids back into names"""
+    return {cat['id']: cat['name'] for cat in get_categories_cached(db)}
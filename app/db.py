@@ -1,16 +1,127 @@
+import os
+import time
 import sqlite3
+import threading
 import click
+from datetime import datetime
 from flask import current_app, g
 from flask.cli import with_appcontext
+from app.process_local import ProcessLocal
+
+# Named pragma sets for the storage the database lives on. WAL with
+# synchronous=NORMAL only fsyncs at checkpoints, so a crash can lose the
+# last few commits but never corrupts the file; FULL fsyncs every commit.
+# A larger wal_autocheckpoint means fewer, larger checkpoint writes.
+STORAGE_PROFILES = {
+    'durable': {
+        'synchronous': 'FULL',
+        'cache_size': -8000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+        'wal_autocheckpoint': 1000,
+        'journal_size_limit': -1,
+    },
+    'ssd': {
+        'synchronous': 'NORMAL',
+        'cache_size': -32000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+        'wal_autocheckpoint': 1000,
+        'journal_size_limit': 64 * 1024 * 1024,
+    },
+    'sd-card': {
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,
+        'wal_autocheckpoint': 4000,
+        'journal_size_limit': 64 * 1024 * 1024,
+    },
+}
+
+def apply_storage_profile(conn, profile):
+    conn.execute('PRAGMA journal_mode=WAL')
+    for pragma, value in STORAGE_PROFILES[profile].items():
+        conn.execute(f'PRAGMA {pragma}={value}')
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection that remembers when it was opened"""
+    pool_created_at = 0.0
+
+class ConnectionPool:
+    """Per-process, per-thread pool of ready-to-use SQLite connections"""
+
+    # Connections are set up once and handed back after each request, so
+    # the page cache and compiled statements survive between requests.
+    # sqlite3 connections are bound to the thread that opened them, hence
+    # one idle stack per thread rather than a shared queue.
+
+    def __init__(self, database, profile='durable', max_idle=2, max_age=3600, check_after=30):
+        self.database = database
+        self.profile = profile
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.check_after = check_after
+        # Connections inherited across a fork belong to the parent process
+        self._local = ProcessLocal(threading.local)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, detect_types=sqlite3.PARSE_DECLTYPES,
+                               factory=PooledConnection)
+        conn.row_factory = sqlite3.Row
+        conn.pool_created_at = time.monotonic()
+        apply_storage_profile(conn, self.profile)
+        return conn
+
+    def _idle(self):
+        local = self._local.get()
+        if not hasattr(local, 'idle'):
+            local.idle = []
+        return local.idle
+
+    def acquire(self):
+        idle = self._idle()
+        now = time.monotonic()
+        while idle:
+            conn, released = idle.pop()
+            if now - conn.pool_created_at > self.max_age:
+                conn.close()
+                continue
+            # Only probe connections that sat unused for a while
+            if now - released > self.check_after:
+                try:
+                    conn.execute('SELECT 1').fetchone()
+                except sqlite3.Error:
+                    conn.close()
+                    continue
+            return conn
+
+        return self._connect()
+
+    def release(self, conn):
+        idle = self._idle()
+        try:
+            # Never hand out a connection with a transaction left open
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+
+        if len(idle) >= self.max_idle or time.monotonic() - conn.pool_created_at > self.max_age:
+            conn.close()
+            return
+        idle.append((conn, time.monotonic()))
+
+def _get_pool():
+    return current_app.extensions['sqlite_pool']
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
-        g.db.execute('PRAGMA journal_mode=WAL')
+        g.db = _get_pool().acquire()
 
     return g.db
 
@@ -18,11 +129,9 @@ def close_db(e=None):
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        _get_pool().release(db)
 
-def init_db():
-    db = get_db()
-    
+def _migration_base_schema(db):
     # Users table with role
     db.execute('''CREATE TABLE IF NOT EXISTS users
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -87,6 +196,497 @@ def init_db():
                   color TEXT DEFAULT '#3b82f6',
                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                   FOREIGN KEY (user_id) REFERENCES users (id))''')
+
+def _migration_query_indexes(db):
+    # Per-user listing: WHERE user_id = ? ORDER BY date DESC, id DESC
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_transactions_user_date
+                  ON transactions (user_id, date DESC, id DESC)''')
+    # Admin listing and CSV export across all users
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_transactions_date
+                  ON transactions (date DESC, id DESC)''')
+    # Type/category filters and per-category stats
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_transactions_type_category
+                  ON transactions (type, category)''')
+    # "Category in use" check when deleting a category
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_transactions_category
+                  ON transactions (category)''')
+
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_notes_user_updated
+                  ON notes (user_id, updated_at DESC)''')
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_reminders_user_due
+                  ON reminders (user_id, due_date)''')
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_calendar_events_user_start
+                  ON calendar_events (user_id, start_time)''')
+
+# SQL for a row's summary month, before and after transactions gained
+# the integer month column; {row} is 'NEW.', 'OLD.' or ''
+_TEXT_MONTH = "COALESCE(strftime('%Y-%m', {row}date), '')"
+_INTEGER_MONTH = 'COALESCE({row}month, 0)'
+
+def _backfill_transaction_summary(db, category_column, month=_INTEGER_MONTH):
+    db.execute('DELETE FROM transaction_summary')
+    db.execute(f'''INSERT INTO transaction_summary
+                   (user_id, month, type, {category_column}, total, count)
+                   SELECT user_id, {month.format(row='')}, type, {category_column},
+                          SUM(amount), COUNT(*)
+                   FROM transactions
+                   GROUP BY 1, 2, 3, 4''')
+
+def rebuild_transaction_summary(db):
+    """Recompute transaction_summary from the transactions table"""
+    _backfill_transaction_summary(db, 'category_id')
+
+def _create_transaction_summary(db, category_column, category_type, total_type,
+                                month_type='INTEGER', month=_INTEGER_MONTH):
+    # Per user, month, type and category totals backing /api/stats
+    db.execute(f'''CREATE TABLE IF NOT EXISTS transaction_summary
+                   (user_id INTEGER NOT NULL,
+                    month {month_type} NOT NULL,
+                    type TEXT NOT NULL,
+                    {category_column} {category_type} NOT NULL,
+                    total {total_type} NOT NULL DEFAULT 0,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, month, type, {category_column})) WITHOUT ROWID''')
+    db.execute(f'''CREATE INDEX IF NOT EXISTS idx_transaction_summary_type_category
+                   ON transaction_summary (type, {category_column})''')
+
+    # Triggers keep the summary in step with every write, inside the
+    # same transaction as the change to transactions itself
+    month_source = 'month' if month == _INTEGER_MONTH else 'date'
+    add_new = f'''INSERT INTO transaction_summary (user_id, month, type, {category_column}, total, count)
+                    VALUES (NEW.user_id, {month.format(row='NEW.')},
+                            NEW.type, NEW.{category_column}, NEW.amount, 1)
+                    ON CONFLICT (user_id, month, type, {category_column}) DO UPDATE
+                    SET total = total + excluded.total, count = count + 1;'''
+    remove_old = f'''UPDATE transaction_summary
+                       SET total = total - OLD.amount, count = count - 1
+                       WHERE user_id = OLD.user_id
+                         AND month = {month.format(row='OLD.')}
+                         AND type = OLD.type AND {category_column} = OLD.{category_column};
+                       DELETE FROM transaction_summary
+                       WHERE user_id = OLD.user_id
+                         AND month = {month.format(row='OLD.')}
+                         AND type = OLD.type AND {category_column} = OLD.{category_column}
+                         AND count <= 0;'''
+    db.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_summary_insert
+                   AFTER INSERT ON transactions
+                   BEGIN
+                       {add_new}
+                   END''')
+    db.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_summary_delete
+                   AFTER DELETE ON transactions
+                   BEGIN
+                       {remove_old}
+                   END''')
+    db.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_summary_update
+                   AFTER UPDATE OF user_id, amount, type, {category_column}, {month_source} ON transactions
+                   BEGIN
+                       {remove_old}
+                       {add_new}
+                   END''')
+
+    # Backfill from existing rows
+    _backfill_transaction_summary(db, category_column, month)
+
+def _migration_transaction_summary(db):
+    _create_transaction_summary(db, 'category', 'TEXT', 'REAL', 'TEXT', _TEXT_MONTH)
+
+def _migration_stats_covering_indexes(db):
+    # Cover the date-ranged stats query so it never touches table rows
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_transactions_stats_user
+                  ON transactions (user_id, date, type, category, amount)''')
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_transactions_stats_date
+                  ON transactions (date, type, category, amount)''')
+
+# Tables whose rows belong to a user; their versions are kept per user
+# and also under user_id 0, which covers admin views across all users
+USER_VERSIONED_TABLES = ('transactions', 'notes', 'reminders', 'calendar_events')
+SHARED_VERSIONED_TABLES = ('categories',)
+
+_BUMP_VERSION = '''INSERT INTO data_versions (table_name, user_id, version)
+                   VALUES ('{table}', {user_id}, 1)
+                   ON CONFLICT (table_name, user_id) DO UPDATE SET version = version + 1;'''
+
+def _migration_data_versions(db):
+    # Change counters used for ETags on GET endpoints
+    db.execute('''CREATE TABLE IF NOT EXISTS data_versions
+                  (table_name TEXT NOT NULL,
+                   user_id INTEGER NOT NULL,
+                   version INTEGER NOT NULL DEFAULT 0,
+                   PRIMARY KEY (table_name, user_id)) WITHOUT ROWID''')
+
+    for table in USER_VERSIONED_TABLES:
+        for event, rows in (('INSERT', ('NEW',)), ('DELETE', ('OLD',)), ('UPDATE', ('OLD', 'NEW'))):
+            bumps = [_BUMP_VERSION.format(table=table, user_id=0)]
+            bumps += [_BUMP_VERSION.format(table=table, user_id=f'{row}.user_id') for row in rows]
+            db.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+                           AFTER {event} ON {table}
+                           BEGIN
+                               {' '.join(bumps)}
+                           END''')
+
+    for table in SHARED_VERSIONED_TABLES:
+        for event in ('INSERT', 'DELETE', 'UPDATE'):
+            db.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+                           AFTER {event} ON {table}
+                           BEGIN
+                               {_BUMP_VERSION.format(table=table, user_id=0)}
+                           END''')
+
+def get_data_versions(db, tables, user_id=0):
+    """Current change counters for the given tables as seen by user_id (0 = all users)"""
+    placeholders = ', '.join('?' for _ in tables)
+    rows = db.execute(f'''SELECT table_name, user_id, version FROM data_versions
+                          WHERE user_id IN (?, 0) AND table_name IN ({placeholders})''',
+                      [user_id, *tables]).fetchall()
+    versions = {(row['table_name'], row['user_id']): row['version'] for row in rows}
+    # Shared tables are only ever counted under user_id 0
+    return [versions.get((table, 0 if table in SHARED_VERSIONED_TABLES else user_id), 0)
+            for table in tables]
+
+def _migration_integer_amounts(db):
+    # Store amounts as integer paise. SQLite cannot change a column's
+    # declared type, so rebuild transactions and everything hanging off it.
+    seq = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transactions'").fetchone()
+
+    db.execute('''CREATE TABLE transactions_new
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  user_id INTEGER NOT NULL,
+                  username TEXT NOT NULL,
+                  amount INTEGER NOT NULL,
+                  type TEXT NOT NULL,
+                  category TEXT NOT NULL,
+                  description TEXT,
+                  date TEXT NOT NULL,
+                  attachment_filename TEXT,
+                  attachment_path TEXT,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  FOREIGN KEY (user_id) REFERENCES users (id))''')
+    db.execute('''INSERT INTO transactions_new
+                  (id, user_id, username, amount, type, category, description, date,
+                   attachment_filename, attachment_path, created_at)
+                  SELECT id, user_id, username, CAST(ROUND(amount * 100) AS INTEGER), type, category,
+                         description, date, attachment_filename, attachment_path, created_at
+                  FROM transactions''')
+    db.execute('DROP TABLE transactions')
+    db.execute('ALTER TABLE transactions_new RENAME TO transactions')
+    if seq is not None:
+        db.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'transactions'", (seq[0],))
+
+    _migration_query_indexes(db)
+    _migration_stats_covering_indexes(db)
+
+    # Summary totals become integers too; this also recreates its triggers
+    db.execute('DROP TABLE transaction_summary')
+    _create_transaction_summary(db, 'category', 'TEXT', 'INTEGER', 'TEXT', _TEXT_MONTH)
+    _migration_data_versions(db)
+
+def _migration_category_ids(db):
+    # Reference categories by id instead of repeating the name (emoji and
+    # all) in every row. Transactions whose category was never in the
+    # categories table get a row created for it so nothing is lost.
+    db.execute('''INSERT OR IGNORE INTO categories (name, type, icon)
+                  SELECT category, MIN(type), '📦' FROM transactions
+                  WHERE category NOT IN (SELECT name FROM categories)
+                  GROUP BY category''')
+
+    seq = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transactions'").fetchone()
+
+    db.execute('''CREATE TABLE transactions_new
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  user_id INTEGER NOT NULL,
+                  username TEXT NOT NULL,
+                  amount INTEGER NOT NULL,
+                  type TEXT NOT NULL,
+                  category_id INTEGER NOT NULL,
+                  description TEXT,
+                  date TEXT NOT NULL,
+                  attachment_filename TEXT,
+                  attachment_path TEXT,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  FOREIGN KEY (user_id) REFERENCES users (id),
+                  FOREIGN KEY (category_id) REFERENCES categories (id))''')
+    db.execute('''INSERT INTO transactions_new
+                  (id, user_id, username, amount, type, category_id, description, date,
+                   attachment_filename, attachment_path, created_at)
+                  SELECT t.id, t.user_id, t.username, t.amount, t.type, c.id, t.description, t.date,
+                         t.attachment_filename, t.attachment_path, t.created_at
+                  FROM transactions t JOIN categories c ON c.name = t.category''')
+    db.execute('DROP TABLE transactions')
+    db.execute('ALTER TABLE transactions_new RENAME TO transactions')
+    if seq is not None:
+        db.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'transactions'", (seq[0],))
+
+    db.execute('''CREATE INDEX idx_transactions_user_date
+                  ON transactions (user_id, date DESC, id DESC)''')
+    db.execute('''CREATE INDEX idx_transactions_date
+                  ON transactions (date DESC, id DESC)''')
+    db.execute('''CREATE INDEX idx_transactions_type_category
+                  ON transactions (type, category_id)''')
+    # "Category in use" check becomes a single index probe
+    db.execute('''CREATE INDEX idx_transactions_category
+                  ON transactions (category_id)''')
+    db.execute('''CREATE INDEX idx_transactions_stats_user
+                  ON transactions (user_id, date, type, category_id, amount)''')
+    db.execute('''CREATE INDEX idx_transactions_stats_date
+                  ON transactions (date, type, category_id, amount)''')
+
+    db.execute('DROP TABLE transaction_summary')
+    _create_transaction_summary(db, 'category_id', 'INTEGER', 'INTEGER', 'TEXT', _TEXT_MONTH)
+    _migration_data_versions(db)
+
+# Formats seen in dates written before they were validated
+LEGACY_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%d-%m-%Y', '%d/%m/%Y', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S')
+LEGACY_DATE_BATCH_SIZE = 1000
+# Where dates that cannot be read at all end up: 1970-01-01, so they sort
+# last in every listing and stay reachable until someone corrects them
+UNREADABLE_DATE_DAY = 0
+UNREADABLE_DATE_MONTH = 197001
+
+def _convert_legacy_dates(db):
+    # Rows still without a day number, parsed in id-ordered batches so a
+    # large table never has to sit in memory at once
+    unreadable = []
+    unreadable_count = 0
+    last_id = 0
+    while True:
+        rows = db.execute('''SELECT id, date FROM transactions WHERE day IS NULL AND id > ?
+                             ORDER BY id LIMIT ?''', (last_id, LEGACY_DATE_BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for trans_id, value in rows:
+            for date_format in LEGACY_DATE_FORMATS:
+                try:
+                    parsed = datetime.strptime(str(value).strip(), date_format)
+                    break
+                except ValueError:
+                    continue
+            else:
+                unreadable_count += 1
+                if len(unreadable) < 20:
+                    unreadable.append(trans_id)
+                continue
+            updates.append((parsed.strftime('%Y-%m-%d'), (parsed - datetime(1970, 1, 1)).days,
+                            parsed.year * 100 + parsed.month, trans_id))
+        db.executemany('UPDATE transactions SET date = ?, day = ?, month = ? WHERE id = ?', updates)
+
+    if unreadable_count:
+        # Keyset pagination and date ranges need a day on every row; the
+        # original text stays in date so it can be seen and fixed
+        db.execute('UPDATE transactions SET day = ?, month = ? WHERE day IS NULL',
+                   (UNREADABLE_DATE_DAY, UNREADABLE_DATE_MONTH))
+        more = ', ...' if unreadable_count > len(unreadable) else ''
+        print(f"Warning: {unreadable_count} transactions have unreadable dates; they are dated "
+              f"1970-01-01 until corrected (ids: {', '.join(str(i) for i in unreadable)}{more})")
+
+def _migration_typed_dates(db):
+    # Integer day number (days since 1970-01-01) and YYYYMM month next to
+    # the date, written by the app together with the normalized date.
+    # Plain columns rather than generated ones, so indexes can cover them.
+    db.execute('ALTER TABLE transactions ADD COLUMN day INTEGER')
+    db.execute('ALTER TABLE transactions ADD COLUMN month INTEGER')
+
+    # The summary is rebuilt below, so its triggers need not run per row
+    for event in ('insert', 'delete', 'update'):
+        db.execute(f'DROP TRIGGER IF EXISTS trg_transactions_summary_{event}')
+
+    # Well-formed YYYY-MM-DD dates, nearly all of them, convert in one
+    # statement. With a modifier date() rolls impossible days like 02-30
+    # over, so those fail the comparison and are left to the Python pass.
+    db.execute('''UPDATE transactions
+                  SET day = CAST(julianday(date) - julianday('1970-01-01') AS INTEGER),
+                      month = CAST(strftime('%Y%m', date) AS INTEGER)
+                  WHERE date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'
+                    AND date(date, '+0 days') = date''')
+    _convert_legacy_dates(db)
+
+    # Listing, ranges and stats move from the text date to the integers
+    for index in ('idx_transactions_user_date', 'idx_transactions_date',
+                  'idx_transactions_stats_user', 'idx_transactions_stats_date'):
+        db.execute(f'DROP INDEX IF EXISTS {index}')
+    db.execute('''CREATE INDEX idx_transactions_user_day
+                  ON transactions (user_id, day DESC, id DESC)''')
+    db.execute('''CREATE INDEX idx_transactions_day
+                  ON transactions (day DESC, id DESC)''')
+    db.execute('''CREATE INDEX idx_transactions_stats_user
+                  ON transactions (user_id, day, type, category_id, month, amount)''')
+    db.execute('''CREATE INDEX idx_transactions_stats_day
+                  ON transactions (day, type, category_id, month, amount)''')
+
+    # Summary months become YYYYMM integers
+    db.execute('DROP TABLE transaction_summary')
+    _create_transaction_summary(db, 'category_id', 'INTEGER', 'INTEGER')
+
+def _migration_attachment_refs(db):
+    # Reference counts for stored attachment files (see app/attachments.py).
+    # Files saved before the content-addressed store keep their flat names
+    # and are counted the same way.
+    db.execute('''CREATE TABLE IF NOT EXISTS attachment_refs
+                  (path TEXT PRIMARY KEY,
+                   refcount INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID''')
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_transactions_attachment
+                  ON transactions (attachment_path) WHERE attachment_path IS NOT NULL''')
+
+    add_new = '''INSERT INTO attachment_refs (path, refcount)
+                   SELECT NEW.attachment_path, 1 WHERE NEW.attachment_path IS NOT NULL
+                   ON CONFLICT (path) DO UPDATE SET refcount = refcount + 1;'''
+    remove_old = '''UPDATE attachment_refs SET refcount = refcount - 1
+                      WHERE path = OLD.attachment_path;'''
+    db.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_attachment_insert
+                   AFTER INSERT ON transactions
+                   BEGIN
+                       {add_new}
+                   END''')
+    db.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_attachment_delete
+                   AFTER DELETE ON transactions
+                   BEGIN
+                       {remove_old}
+                   END''')
+    db.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_transactions_attachment_update
+                   AFTER UPDATE OF attachment_path ON transactions
+                   WHEN OLD.attachment_path IS NOT NEW.attachment_path
+                   BEGIN
+                       {remove_old}
+                       {add_new}
+                   END''')
+
+    db.execute('DELETE FROM attachment_refs')
+    db.execute('''INSERT INTO attachment_refs (path, refcount)
+                  SELECT attachment_path, COUNT(*) FROM transactions
+                  WHERE attachment_path IS NOT NULL
+                  GROUP BY attachment_path''')
+
+def _migration_attachment_sizes(db):
+    # Stored size of each transaction's attachment, summed for the
+    # per-user upload quota
+    db.execute('ALTER TABLE transactions ADD COLUMN attachment_size INTEGER')
+
+    folder = current_app.config.get('UPLOAD_FOLDER')
+    if not folder:
+        return
+    paths = db.execute('''SELECT DISTINCT attachment_path FROM transactions
+                           WHERE attachment_path IS NOT NULL''').fetchall()
+    for (path,) in paths:
+        try:
+            size = os.path.getsize(os.path.join(folder, path))
+        except OSError:
+            continue
+        db.execute('UPDATE transactions SET attachment_size = ? WHERE attachment_path = ?', (size, path))
+
+def _migration_jobs(db):
+    # Background job queue (see app/jobs.py). Times are Unix epoch seconds
+    # so the runner can compare them directly with time.time().
+    db.execute('''CREATE TABLE IF NOT EXISTS jobs
+                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   name TEXT NOT NULL,
+                   args TEXT NOT NULL,
+                   status TEXT NOT NULL DEFAULT 'queued',
+                   attempts INTEGER NOT NULL DEFAULT 0,
+                   max_attempts INTEGER NOT NULL,
+                   run_at REAL NOT NULL,
+                   locked_by TEXT,
+                   locked_until REAL,
+                   result TEXT,
+                   error TEXT,
+                   created_at REAL NOT NULL,
+                   updated_at REAL NOT NULL)''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs (status, run_at)')
+
+def _migration_exports(db):
+    # Export files generated in the background (see app/routes/exports.py)
+    db.execute('''CREATE TABLE IF NOT EXISTS exports
+                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   user_id INTEGER NOT NULL,
+                   job_id INTEGER,
+                   format TEXT NOT NULL,
+                   filters TEXT NOT NULL,
+                   status TEXT NOT NULL DEFAULT 'queued',
+                   total_rows INTEGER,
+                   rows_written INTEGER NOT NULL DEFAULT 0,
+                   file_name TEXT,
+                   file_size INTEGER,
+                   error TEXT,
+                   created_at REAL NOT NULL,
+                   finished_at REAL,
+                   FOREIGN KEY (user_id) REFERENCES users (id))''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_exports_user ON exports (user_id, id)')
+
+def _migration_undated_transactions(db):
+    # Databases that reached typed dates before unreadable ones were given
+    # a day still hold rows without one, which keyset pagination can never
+    # reach; the summary triggers move their totals along
+    _convert_legacy_dates(db)
+
+def _migration_attachment_usage_index(db):
+    # The per-upload quota check sums one user's attachment sizes. Only
+    # rows with a stored size go in the index, and it covers the sum.
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_transactions_attachment_usage
+                  ON transactions (user_id, attachment_size) WHERE attachment_size IS NOT NULL''')
+
+def _migration_job_schedule_index(db):
+    # Periodic jobs are due when the last one of their name is old enough
+    db.execute('CREATE INDEX IF NOT EXISTS idx_jobs_name_created_at ON jobs (name, created_at)')
+
+# Ordered schema migrations. The position in this list (1-based) is the
+# schema version stored in PRAGMA user_version once the step has run.
+# Never reorder or remove entries; append new steps at the end.
+MIGRATIONS = [
+    _migration_base_schema,
+    _migration_query_indexes,
+    _migration_transaction_summary,
+    _migration_stats_covering_indexes,
+    _migration_data_versions,
+    _migration_integer_amounts,
+    _migration_category_ids,
+    _migration_typed_dates,
+    _migration_attachment_refs,
+    _migration_attachment_sizes,
+    _migration_jobs,
+    _migration_exports,
+    _migration_undated_transactions,
+    _migration_attachment_usage_index,
+    _migration_job_schedule_index,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate_db(db=None):
+    """Apply pending migrations and return the list of versions applied"""
+    if db is None:
+        db = get_db()
+
+    # Fast path: nothing to do on an up-to-date database
+    if get_schema_version(db) >= SCHEMA_VERSION:
+        return []
+
+    applied = []
+    db.commit()
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        # Take the write lock before re-checking so concurrent workers
+        # starting at the same time apply each step exactly once
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if get_schema_version(db) >= version:
+                db.rollback()
+                continue
+            migration(db)
+            db.execute(f'PRAGMA user_version = {version}')
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied.append(version)
+
+    return applied
+
+def init_db():
+    db = get_db()
+    migrate_db(db)
     
     # Insert default categories if table is empty
     cur = db.execute('SELECT COUNT(*) FROM categories')
@@ -120,6 +720,53 @@ def init_db_command():
     init_db()
     click.echo('Initialized the database.')
 
+@click.command('migrate-db')
+@with_appcontext
+def migrate_db_command():
+    """Apply pending schema migrations."""
+    db = get_db()
+    applied = migrate_db(db)
+    if applied:
+        click.echo(f'Applied migrations: {", ".join(str(v) for v in applied)}.')
+    click.echo(f'Database schema is at version {get_schema_version(db)}.')
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats_command():
+    """Recompute the transaction summary used by the stats endpoint."""
+    db = get_db()
+    rebuild_transaction_summary(db)
+    db.commit()
+    click.echo('Rebuilt transaction summary.')
+
+@click.command('checkpoint-db')
+@with_appcontext
+def checkpoint_db_command():
+    """Checkpoint the WAL into the database file and truncate it."""
+    busy, log_pages, checkpointed = get_db().execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    if busy:
+        click.echo('Checkpoint incomplete: database is busy.')
+    else:
+        click.echo(f'Checkpointed {checkpointed} of {log_pages} WAL pages.')
+
 def init_app(app):
+    profile = app.config.get('DB_PROFILE', 'durable')
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown DB_PROFILE '{profile}', expected one of: {', '.join(STORAGE_PROFILES)}")
+
+    app.extensions['sqlite_pool'] = ConnectionPool(
+        app.config['DATABASE'],
+        profile=profile,
+        max_idle=app.config.get('DB_POOL_MAX_IDLE', 2),
+        max_age=app.config.get('DB_POOL_MAX_AGE', 3600)
+    )
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(checkpoint_db_command)
+
+    # Bring existing databases up to date when a worker starts
+    if app.config.get('MIGRATE_ON_STARTUP', True):
+        with app.app_context():
+            migrate_db()
@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import random
+import signal
+import socket
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from app.db import get_db
+from app.writer import run_write
+from app.process_local import ProcessLocal, spawn_context
+
+# Background jobs kept in the jobs table, so slow side effects can leave
+# the request path without a broker. Route code queues work with
+# f.enqueue(...) on a function decorated with @job. A runner claims due
+# jobs by taking a lease on them (locked_by/locked_until), runs them in a
+# thread or process pool, and records the result. A failed job is retried
+# with exponential backoff. A job whose lease runs out (its worker died)
+# is picked up again, so jobs should be safe to run more than once.
+#
+# Each web worker process runs a small runner of its own
+# (JOB_WORKER_THREADS, 0 to turn it off). `flask worker` runs a dedicated
+# one, with more threads or with processes for CPU-heavy jobs.
+
+JobSpec = namedtuple('JobSpec', 'func max_attempts retry_delay')
+
+# Registered jobs by name; modules register theirs when imported
+JOBS = {}
+
+DEFAULT_RETRY_DELAY = 10
+# Longest wait between retries of a failing job, in seconds
+MAX_RETRY_DELAY = 3600
+# How often finished jobs past JOB_RETENTION_DAYS are deleted
+PURGE_INTERVAL = 3600
+# How often a runner checks whether a periodic job is due
+SCHEDULE_INTERVAL = 60
+
+_DUE = '''(status = 'queued' AND run_at <= :now)
+          OR (status = 'running' AND locked_until < :now)'''
+
+def job(name=None, max_attempts=5, retry_delay=DEFAULT_RETRY_DELAY):
+    """Register a function as a background job and give it f.enqueue(*args, **kwargs)
+
+    Arguments are stored as JSON, so they must be JSON serializable.
+    retry_delay is the wait in seconds before the first retry; it doubles
+    for each later attempt.
+    """
+    def decorator(f):
+        job_name = name or f'{f.__module__}.{f.__qualname__}'
+        JOBS[job_name] = JobSpec(f, max_attempts, retry_delay)
+        f.job_name = job_name
+        f.enqueue = lambda *args, **kwargs: enqueue(job_name, args, kwargs)
+        return f
+    return decorator
+
+def enqueue(name, args=(), kwargs=None, delay=0, conn=None):
+    """Queue job name to run with args and kwargs, returning the job id
+
+    Pass conn from inside a run_write function to queue the job in the
+    same transaction as the write it belongs to, then call notify() once
+    run_write has returned.
+    """
+    spec = JOBS[name]
+    payload = json.dumps({'args': list(args), 'kwargs': kwargs or {}})
+
+    def _insert(conn):
+        now = time.time()
+        return conn.execute('''INSERT INTO jobs (name, args, max_attempts, run_at, created_at, updated_at)
+                               VALUES (?, ?, ?, ?, ?, ?)''',
+                            (name, payload, spec.max_attempts, now + delay, now, now)).lastrowid
+
+    if conn is not None:
+        return _insert(conn)
+
+    job_id = run_write(_insert)
+    if delay <= 0:
+        notify()
+    return job_id
+
+def every(app, interval, name, args=(), kwargs=None):
+    """Have the app's runners queue job name every interval seconds
+
+    Every runner checks, but the check and the insert share a write, so
+    each run is queued once however many workers there are.
+    """
+    app.extensions.setdefault('periodic_jobs', {})[name] = (interval, list(args), kwargs or {})
+
+def notify():
+    """Have this process's runner look for due jobs now rather than at its next poll"""
+    runner = current_app.extensions.get('job_runner')
+    if runner is not None:
+        runner.ensure_started()
+        runner.wake()
+
+def get_job(job_id):
+    """Row for a job, or None"""
+    return get_db().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+# Process pool workers each build their own app from the parent's config
+_process_app = None
+
+def _init_process(config):
+    global _process_app
+    from app import create_app
+    _process_app = create_app(config)
+
+def _run_in_process(name, args, kwargs):
+    with _process_app.app_context():
+        return JOBS[name].func(*args, **kwargs)
+
+class JobRunner:
+    """Claims due jobs from the jobs table and runs them in a pool"""
+
+    def __init__(self, app, threads=1, processes=0, poll_interval=2.0, lease=60):
+        self.app = app
+        self.threads = threads
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.worker_id = None
+        self._wake = threading.Event()
+        self._running = {}
+        # The thread running this runner in the current process
+        self._thread = ProcessLocal(self._start)
+
+    def ensure_started(self):
+        """Run in a background thread of this process, starting it if needed"""
+        self._thread.get()
+
+    def _start(self):
+        self._wake = threading.Event()
+        self._running = {}
+        thread = threading.Thread(target=self.run, name='job-runner', daemon=True)
+        thread.start()
+        return thread
+
+    def wake(self):
+        self._wake.set()
+
+    def _make_executor(self):
+        if self.processes:
+            config = dict(self.app.config, JOB_WORKER_THREADS=0, MIGRATE_ON_STARTUP=False)
+            return ProcessPoolExecutor(max_workers=self.processes, mp_context=spawn_context(),
+                                       initializer=_init_process, initargs=(config,))
+        return ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='job')
+
+    def run(self, stop=None):
+        """Claim and run jobs until stop is set, then wait for running ones"""
+        # Called directly by `flask worker`: this is then the process's runner
+        self._thread.set(threading.current_thread())
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+        stop = stop or threading.Event()
+        executor = self._make_executor()
+        last_renewal = last_purge = last_schedule = 0
+        try:
+            while not stop.is_set():
+                try:
+                    with self.app.app_context():
+                        now = time.time()
+                        if self._running and now - last_renewal >= self.lease / 3:
+                            self._renew_leases(now)
+                            last_renewal = now
+                        if now - last_purge >= PURGE_INTERVAL:
+                            self._purge(now)
+                            last_purge = now
+                        if now - last_schedule >= SCHEDULE_INTERVAL:
+                            self._schedule()
+                            last_schedule = now
+                        free = (self.processes or self.threads) - len(self._running)
+                        if free > 0:
+                            for job_id, name, payload in self._claim(free):
+                                self._submit(executor, job_id, name, payload)
+                except Exception as e:
+                    print(f"Error in job runner: {e}")
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+        finally:
+            executor.shutdown(wait=True)
+
+    def _claim(self, limit):
+        # A plain read first, so an idle queue never takes the write lock
+        if get_db().execute(f'SELECT 1 FROM jobs WHERE {_DUE} LIMIT 1', {'now': time.time()}).fetchone() is None:
+            return []
+
+        worker_id, lease = self.worker_id, self.lease
+
+        def _take(conn):
+            now = time.time()
+            # Out of attempts and its last worker died: give up on it
+            conn.execute('''UPDATE jobs SET status = 'failed', error = 'Lease expired', updated_at = :now,
+                                            locked_by = NULL, locked_until = NULL
+                            WHERE status = 'running' AND locked_until < :now AND attempts >= max_attempts''',
+                         {'now': now})
+            rows = conn.execute(f'SELECT id, name, args FROM jobs WHERE {_DUE} ORDER BY run_at, id LIMIT :limit',
+                                {'now': now, 'limit': limit}).fetchall()
+            conn.executemany('''UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                                                locked_by = ?, locked_until = ?, updated_at = ?
+                                WHERE id = ?''',
+                             [(worker_id, now + lease, now, row['id']) for row in rows])
+            return [tuple(row) for row in rows]
+
+        return run_write(_take)
+
+    def _call(self, name, args, kwargs):
+        with self.app.app_context():
+            return JOBS[name].func(*args, **kwargs)
+
+    def _submit(self, executor, job_id, name, payload):
+        payload = json.loads(payload)
+        if name not in JOBS:
+            future = executor.submit(_unknown_job, name)
+        elif self.processes:
+            future = executor.submit(_run_in_process, name, payload['args'], payload['kwargs'])
+        else:
+            future = executor.submit(self._call, name, payload['args'], payload['kwargs'])
+        self._running[job_id] = future
+        future.add_done_callback(lambda future: self._finished(job_id, name, future))
+
+    def _finished(self, job_id, name, future):
+        self._running.pop(job_id, None)
+        error = future.exception()
+        worker_id = self.worker_id
+        try:
+            with self.app.app_context():
+                if error is None:
+                    result = json.dumps(future.result(), default=str)
+                    run_write(lambda conn: conn.execute(
+                        '''UPDATE jobs SET status = 'done', result = ?, error = NULL, updated_at = ?,
+                                           locked_by = NULL, locked_until = NULL
+                           WHERE id = ? AND locked_by = ?''', (result, time.time(), job_id, worker_id)))
+                else:
+                    print(f"Error in job {name} ({job_id}): {error}")
+                    retry_delay = JOBS[name].retry_delay if name in JOBS else DEFAULT_RETRY_DELAY
+                    run_write(lambda conn: _retry_or_fail(conn, job_id, worker_id, retry_delay, error))
+        except Exception as e:
+            print(f"Error recording job {job_id}: {e}")
+        self.wake()
+
+    def _renew_leases(self, now):
+        job_ids = list(self._running)
+        if not job_ids:
+            return
+        worker_id, until = self.worker_id, now + self.lease
+        placeholders = ', '.join('?' * len(job_ids))
+        run_write(lambda conn: conn.execute(
+            f'''UPDATE jobs SET locked_until = ?
+                WHERE locked_by = ? AND status = 'running' AND id IN ({placeholders})''',
+            [until, worker_id] + job_ids))
+
+    def _purge(self, now):
+        cutoff = now - self.app.config.get('JOB_RETENTION_DAYS', 7) * 86400
+        # Skip the write lock when there is nothing old enough
+        if get_db().execute('''SELECT 1 FROM jobs WHERE status IN ('done', 'failed')
+                               AND updated_at < ? LIMIT 1''', (cutoff,)).fetchone() is None:
+            return
+        run_write(lambda conn: conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,)))
+
+    def _schedule(self):
+        periodic = self.app.extensions.get('periodic_jobs')
+        if not periodic:
+            return
+
+        def _due(conn):
+            now = time.time()
+            return [name for name, (interval, args, kwargs) in periodic.items()
+                    if (conn.execute('SELECT MAX(created_at) FROM jobs WHERE name = ?', (name,)).fetchone()[0]
+                        or 0) <= now - interval]
+
+        # A plain read first, so the write lock is only taken when a run is due
+        if not _due(get_db()):
+            return
+
+        def _enqueue_due(conn):
+            names = _due(conn)
+            for name in names:
+                interval, args, kwargs = periodic[name]
+                enqueue(name, args, kwargs, conn=conn)
+            return names
+
+        if run_write(_enqueue_due):
+            self.wake()
+
+def _unknown_job(name):
+    # Queued by newer code than this worker runs; retried like a failure
+    raise LookupError(f'Unknown job: {name}')
+
+def _retry_or_fail(conn, job_id, worker_id, retry_delay, error):
+    row = conn.execute('SELECT attempts, max_attempts FROM jobs WHERE id = ? AND locked_by = ?',
+                       (job_id, worker_id)).fetchone()
+    if row is None:
+        # Lease lost to another worker meanwhile
+        return
+    now = time.time()
+    if row['attempts'] >= row['max_attempts']:
+        conn.execute('''UPDATE jobs SET status = 'failed', error = ?, updated_at = ?,
+                                        locked_by = NULL, locked_until = NULL
+                        WHERE id = ?''', (str(error), now, job_id))
+        return
+    # Exponential backoff with jitter so failing jobs do not retry in step
+    delay = min(retry_delay * 2 ** (row['attempts'] - 1), MAX_RETRY_DELAY) * (0.5 + random.random())
+    conn.execute('''UPDATE jobs SET status = 'queued', error = ?, run_at = ?, updated_at = ?,
+                                    locked_by = NULL, locked_until = NULL
+                    WHERE id = ?''', (str(error), now + delay, now, job_id))
+
+@click.command('worker')
+@click.option('--threads', default=4, show_default=True, help='Jobs run at once in threads.')
+@click.option('--processes', default=0, help='Run jobs in this many processes instead of threads.')
+@with_appcontext
+def worker_command(threads, processes):
+    """Run background jobs until interrupted."""
+    app = current_app._get_current_object()
+    runner = JobRunner(app, threads=threads, processes=processes,
+                       poll_interval=app.config.get('JOB_POLL_INTERVAL', 2),
+                       lease=app.config.get('JOB_LEASE_SECONDS', 60))
+    # Jobs that queue more jobs wake this runner rather than starting another
+    app.extensions['job_runner'] = runner
+
+    stop = threading.Event()
+
+    def _stop(signum, frame):
+        stop.set()
+        runner.wake()
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+    pool = f'{processes} processes' if processes else f'{threads} threads'
+    click.echo(f'Running jobs with {pool}; Ctrl+C to stop.')
+    runner.run(stop)
+    click.echo('Worker stopped.')
+
+def init_app(app):
+    threads = app.config.get('JOB_WORKER_THREADS', 1)
+    if threads:
+        runner = JobRunner(app, threads=threads,
+                           poll_interval=app.config.get('JOB_POLL_INTERVAL', 2),
+                           lease=app.config.get('JOB_LEASE_SECONDS', 60))
+        app.extensions['job_runner'] = runner
+        # Started by the first request each worker process serves
+        app.before_request(runner.ensure_started)
+    app.cli.add_command(worker_command)
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from app.attachments import PREVIEW_SUFFIX, SNIFF_BYTES, sniff_kind
+from app.process_local import ProcessLocal, spawn_context
+
+# Downscaled JPEG previews of image and PDF attachments, rendered in a
+# small process pool after upload so decoding a 12 MP photo never runs on
+# a request thread. Each preview sits next to its original as
+# <store path>.thumb.jpg; originals are content-addressed, so a preview
+# never goes stale and is removed together with its original.
+
+PREVIEW_SIZE = (320, 320)
+PREVIEW_QUALITY = 75
+PREVIEWABLE_KINDS = ('jpeg', 'png', 'gif', 'bmp', 'pdf')
+
+def preview_path(file_path):
+    return file_path + PREVIEW_SUFFIX
+
+def _render_pdf_page(source, directory):
+    """First page of a PDF as a PNG in directory, via poppler's pdftoppm"""
+    pdftoppm = shutil.which('pdftoppm')
+    if not pdftoppm:
+        return None
+    prefix = os.path.join(directory, 'page')
+    subprocess.run([pdftoppm, '-png', '-f', '1', '-l', '1', '-singlefile',
+                    '-scale-to', str(max(PREVIEW_SIZE) * 2), source, prefix],
+                   check=True, capture_output=True, timeout=60)
+    return prefix + '.png'
+
+def render_preview(source, target, kind):
+    """Write a JPEG preview of source to target; runs in a pool process"""
+    from PIL import Image, ImageOps
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(target)) as work_dir:
+        if kind == 'pdf':
+            source = _render_pdf_page(source, work_dir)
+            if source is None:
+                return False
+
+        with Image.open(source) as image:
+            # Let the JPEG decoder skip straight to a reduced scale
+            image.draft('RGB', (PREVIEW_SIZE[0] * 2, PREVIEW_SIZE[1] * 2))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(PREVIEW_SIZE)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+
+            # Rename into place so a reader never sees half a file
+            temp_path = os.path.join(work_dir, 'preview.jpg')
+            image.save(temp_path, 'JPEG', quality=PREVIEW_QUALITY, optimize=True)
+            os.replace(temp_path, target)
+    return True
+
+class PreviewPool:
+    """Per-process pool of preview renderers, started on first use"""
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = ProcessLocal(self._start)
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=spawn_context())
+
+    def _start(self):
+        self._pending = set()
+        return self._new_executor()
+
+    def _replace_broken(self, executor):
+        # A renderer died (the OOM killer on a Pi, say) and took the pool
+        # with it; start a fresh one rather than failing every later upload
+        fresh = self._new_executor()
+        current = self._executor.replace(executor, fresh)
+        # Another thread may have replaced it first
+        (executor if current is fresh else fresh).shutdown(wait=False)
+        return current
+
+    def submit(self, source, kind):
+        target = preview_path(source)
+        executor = self._executor.get()
+        with self._lock:
+            if target in self._pending:
+                return
+            self._pending.add(target)
+
+        def _done(future):
+            with self._lock:
+                self._pending.discard(target)
+            if future.exception() is not None:
+                print(f"Error rendering preview for {source}: {future.exception()}")
+
+        try:
+            try:
+                future = executor.submit(render_preview, source, target, kind)
+            except BrokenProcessPool:
+                future = self._replace_broken(executor).submit(render_preview, source, target, kind)
+        except Exception:
+            with self._lock:
+                self._pending.discard(target)
+            raise
+        future.add_done_callback(_done)
+
+def _pool():
+    return current_app.extensions['preview_pool']
+
+def preview_kind(file_path):
+    """Kind of a stored file if it can have a preview, else None"""
+    try:
+        with open(file_path, 'rb') as f:
+            kind = sniff_kind(f.read(SNIFF_BYTES))
+    except OSError:
+        return None
+    if kind == 'pdf' and not shutil.which('pdftoppm'):
+        return None
+    return kind if kind in PREVIEWABLE_KINDS else None
+
+def schedule(store_path):
+    """Queue a preview for a stored file unless it exists or cannot be made
+
+    Never raises: callers have already committed the upload, and a preview
+    that could not be queued is queued again when the thumbnail is asked for.
+    """
+    if 'preview_pool' not in current_app.extensions:
+        return
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], store_path)
+    try:
+        if os.path.exists(preview_path(file_path)):
+            return
+        kind = preview_kind(file_path)
+        if kind:
+            _pool().submit(file_path, kind)
+    except Exception as e:
+        print(f"Error scheduling preview for {store_path}: {e}")
+
+def init_app(app):
+    if app.config.get('ATTACHMENT_PREVIEWS', True):
+        app.extensions['preview_pool'] = PreviewPool(max_workers=app.config.get('PREVIEW_WORKERS', 1))
@@ -0,0 +1,51 @@
+import os
+import threading
+import multiprocessing
+
+# Background threads and pools that have to live in each worker process.
+#
+# gunicorn imports the app, and with --preload builds it, in the master
+# process and then forks the workers. A fork copies objects but not the
+# threads behind them: a writer thread, job runner or process pool set up
+# before the fork would look alive in every worker while nothing serves
+# its queue. So they are started lazily, on first use, by the process
+# that uses them, and started again if that turns out to be a different
+# process from the one that built them.
+#
+# For the same reason child processes are spawned rather than forked: by
+# the time a worker needs one it is running threads, and a forked child
+# can inherit a lock some thread held at that moment and never get it.
+
+class ProcessLocal:
+    """A value built by factory() once in each process that asks for it"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self._pid = None
+
+    def get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self._factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    def set(self, value):
+        """Use value in this process instead of building one"""
+        with self._lock:
+            self._value = value
+            self._pid = os.getpid()
+
+    def replace(self, old, value):
+        """Swap in value if old is still current; return the current value"""
+        with self._lock:
+            if self._pid == os.getpid() and self._value is old:
+                self._value = value
+            return self._value
+
+def spawn_context():
+    """multiprocessing context for pools started from a worker"""
+    return multiprocessing.get_context('spawn')
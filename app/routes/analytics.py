@@ -0,0 +1,187 @@
+import calendar
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+from flask import Blueprint, request, jsonify, current_app
+from app.db import get_db, get_data_versions
+from app.cache import get_categories_cached
+from app.utils import login_required, parse_date, from_minor_units, scoped_user_id
+
+bp = Blueprint('analytics', __name__, url_prefix='/api')
+
+# Rolling spend, month-over-month category trends and a month-end
+# forecast, computed with numpy over per-day and per-month totals.
+# Results are kept per worker, keyed by the data_versions counters, so a
+# dashboard refresh is a dictionary lookup until the user's data changes.
+
+# transactions.day counts days from here
+EPOCH = date(1970, 1, 1)
+ANALYTICS_CACHE_SIZE = 128
+# Full months of history the income forecast averages over
+FORECAST_INCOME_MONTHS = 3
+
+_analytics_cache = OrderedDict()
+_analytics_lock = threading.Lock()
+
+def _int_arg(name, default, low, high):
+    # Parsed here rather than with type=int, which quietly falls back to
+    # the default when the value is not a number
+    raw = request.args.get(name)
+    try:
+        value = int(raw) if raw else default
+    except ValueError:
+        value = None
+    if value is None or not low <= value <= high:
+        raise ValueError(f'{name} must be a whole number from {low} to {high}')
+    return value
+
+def _month_index(year, month):
+    return year * 12 + month - 1
+
+def _month_number(index):
+    # YYYYMM, as stored in transactions.month and transaction_summary
+    return (index // 12) * 100 + index % 12 + 1
+
+def _month_label(index):
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+def _rupees(values):
+    return [from_minor_units(int(round(value))) for value in values]
+
+def compute_analytics(db, user_id, as_of, days, window, months):
+    """Rolling daily spend, category trends and month-end forecast for user_id (None = everyone)"""
+    import numpy as np
+
+    as_of_day = (as_of - EPOCH).days
+    as_of_month = _month_index(as_of.year, as_of.month)
+    month_start_day = (as_of.replace(day=1) - EPOCH).days
+    first_series_day = as_of_day - days - window + 2
+    # One extra month so the first reported month has a delta, and enough
+    # full months behind the current one for the income average
+    span = max(months, FORECAST_INCOME_MONTHS) + 1
+    first_month = as_of_month - span + 1
+
+    scope = ' AND user_id = ?' if user_id is not None else ''
+    scope_params = [user_id] if user_id is not None else []
+
+    # SQLite does the row-level summing (daily totals off the covering
+    # (user_id, day, ...) index, monthly ones from transaction_summary), so
+    # only a few thousand numbers reach numpy however long the history
+    first_day = min(first_series_day, month_start_day)
+    daily_rows = db.execute(f'''SELECT day, type = 'income', SUM(amount) FROM transactions
+                                WHERE day >= ? AND day <= ?{scope} GROUP BY day, type''',
+                            [first_day, as_of_day] + scope_params).fetchall()
+    month_rows = db.execute(f'''SELECT month, category_id, type = 'income', SUM(total) FROM transaction_summary
+                                WHERE month >= ? AND month <= ?{scope} GROUP BY month, category_id, type''',
+                            [_month_number(first_month), _month_number(as_of_month)] + scope_params).fetchall()
+    before = dict(db.execute(f'''SELECT type, SUM(total) FROM transaction_summary
+                                 WHERE month < ?{scope} GROUP BY type''',
+                             [_month_number(as_of_month)] + scope_params).fetchall())
+
+    day, day_income, day_total = np.array(daily_rows, dtype=np.int64).reshape(-1, 3).T
+    day_income = day_income.astype(bool)
+    month, category_id, month_income, month_total = np.array(month_rows, dtype=np.int64).reshape(-1, 4).T
+    month_income = month_income.astype(bool)
+    month_position = (month // 100) * 12 + month % 100 - 1 - first_month
+
+    # Daily spend over the series plus the window before it, then rolling
+    # means from differences of the running total
+    spent = ~day_income & (day >= first_series_day)
+    daily = np.bincount(day[spent] - first_series_day, weights=day_total[spent], minlength=days + window - 1)
+    running = np.concatenate(([0.0], np.cumsum(daily)))
+    rolling = (running[window:] - running[:-window]) / window
+    series_days = np.arange(as_of_day - days + 1, as_of_day + 1)
+
+    # Category totals per month as a (category, month) grid; the last
+    # months + 1 columns give the reported months and their deltas
+    categories, position = np.unique(category_id, return_inverse=True)
+    grid = np.bincount(position * span + month_position, weights=month_total,
+                       minlength=len(categories) * span).reshape(len(categories), span)[:, -(months + 1):]
+    deltas = np.diff(grid, axis=1)
+    previous = grid[:, :-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = np.where(previous > 0, deltas * 100 / previous, np.nan)
+
+    labels = {cat['id']: cat for cat in get_categories_cached(db)}
+    trends = {'expense': [], 'income': []}
+    for row in np.argsort(-grid[:, -1], kind='stable'):
+        category = labels.get(int(categories[row]))
+        if category is None:
+            continue
+        trends[category['type']].append({
+            'category': category['name'],
+            'totals': _rupees(grid[row, 1:]),
+            'deltas': _rupees(deltas[row]),
+            'change_pct': [None if np.isnan(value) else round(float(value), 1) for value in change[row]],
+        })
+
+    # Month-end forecast: spending continues at this month's daily rate;
+    # income is what has arrived or the recent monthly average, whichever
+    # is larger, since it tends to land in one or two lumps
+    days_in_month = calendar.monthrange(as_of.year, as_of.month)[1]
+    this_month = day >= month_start_day
+    income_to_date = int(day_total[this_month & day_income].sum())
+    expense_to_date = int(day_total[this_month & ~day_income].sum())
+    monthly_income = np.bincount(month_position[month_income], weights=month_total[month_income], minlength=span)
+    average_income = monthly_income[-FORECAST_INCOME_MONTHS - 1:-1].mean()
+    projected_expense = expense_to_date / as_of.day * days_in_month
+    projected_income = max(income_to_date, average_income)
+    balance = before.get('income', 0) - before.get('expense', 0) + income_to_date - expense_to_date
+
+    return {
+        'as_of': as_of.isoformat(),
+        'rolling_spend': {
+            'window': window,
+            'dates': [(EPOCH + timedelta(days=int(day))).isoformat() for day in series_days],
+            'daily': _rupees(daily[window - 1:]),
+            'average': _rupees(rolling),
+        },
+        'category_trends': {
+            'months': [_month_label(index) for index in range(as_of_month - months + 1, as_of_month + 1)],
+            'expense': trends['expense'],
+            'income': trends['income'],
+        },
+        'forecast': {
+            'month': _month_label(as_of_month),
+            'days_elapsed': as_of.day,
+            'days_in_month': days_in_month,
+            'income_to_date': from_minor_units(income_to_date),
+            'expense_to_date': from_minor_units(expense_to_date),
+            'daily_expense_rate': from_minor_units(int(round(expense_to_date / as_of.day))),
+            'projected_income': from_minor_units(int(round(projected_income))),
+            'projected_expense': from_minor_units(int(round(projected_expense))),
+            'balance': from_minor_units(balance),
+            'projected_balance': from_minor_units(int(round(
+                balance + projected_income - income_to_date - (projected_expense - expense_to_date)))),
+        },
+    }
+
+@bp.route('/analytics', methods=['GET'])
+@login_required
+def get_analytics():
+    try:
+        # Same scoping as /api/stats: admins may look at everyone or one user
+        user_id = scoped_user_id()
+        as_of = parse_date(request.args['as_of']).date() if request.args.get('as_of') else date.today()
+        days = _int_arg('days', 90, 1, 3660)
+        window = _int_arg('window', 30, 1, 365)
+        months = _int_arg('months', 12, 1, 120)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    db = get_db()
+    versions = get_data_versions(db, ('transactions', 'categories'), user_id or 0)
+    key = (current_app.config['DATABASE'], user_id, tuple(versions), as_of, days, window, months)
+
+    with _analytics_lock:
+        result = _analytics_cache.get(key)
+        if result is not None:
+            _analytics_cache.move_to_end(key)
+    if result is None:
+        result = compute_analytics(db, user_id, as_of, days, window, months)
+        with _analytics_lock:
+            _analytics_cache[key] = result
+            while len(_analytics_cache) > ANALYTICS_CACHE_SIZE:
+                _analytics_cache.popitem(last=False)
+
+    return jsonify(result)
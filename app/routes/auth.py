@@ -1,7 +1,9 @@
 import os
+import sqlite3
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, session, current_app
 from werkzeug.security import generate_password_hash, check_password_hash
 from app.db import get_db
+from app.writer import run_write
 
 bp = Blueprint('auth', __name__)
 
@@ -37,10 +39,12 @@ def register():
         
         # Create user
         hashed_password = generate_password_hash(password)
-        c.execute('INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
-                  (username, hashed_password, role))
-        db.commit()
-        user_id = c.lastrowid
+        try:
+            user_id = run_write(lambda conn: conn.execute(
+                'INSERT INTO users (username, password, role) VALUES (?, ?, ?)',
+                (username, hashed_password, role)).lastrowid)
+        except sqlite3.IntegrityError:
+            return jsonify({'error': 'Username already exists'}), 400
         
         session['user_id'] = user_id
         session['username'] = username
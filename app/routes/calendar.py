@@ -1,11 +1,13 @@
 from flask import Blueprint, request, jsonify, session
 from app.db import get_db
-from app.utils import login_required
+from app.writer import run_write
+from app.utils import login_required, conditional_get
 
 bp = Blueprint('calendar', __name__, url_prefix='/api/calendar')
 
 @bp.route('/events', methods=['GET'])
 @login_required
+@conditional_get('calendar_events', 'reminders', 'notes')
 def get_calendar_events():
     user_id = session['user_id']
     db = get_db()
@@ -46,14 +48,10 @@ def add_calendar_event():
     if not title or not start_time:
         return jsonify({'error': 'Title and start time are required'}), 400
         
-    db = get_db()
-    c = db.cursor()
-    c.execute('''INSERT INTO calendar_events 
+    event_id = run_write(lambda conn: conn.execute('''INSERT INTO calendar_events 
                  (user_id, title, description, start_time, end_time, color) 
                  VALUES (?, ?, ?, ?, ?, ?)''',
-              (user_id, title, description, start_time, end_time, color))
-    db.commit()
-    event_id = c.lastrowid
+              (user_id, title, description, start_time, end_time, color)).lastrowid)
     return jsonify({'id': event_id, 'message': 'Event added successfully'}), 201
 
 @bp.route('/events/<int:event_id>', methods=['PUT'])
@@ -67,21 +65,15 @@ def update_calendar_event(event_id):
     end_time = data.get('end_time')
     color = data.get('color', '#3b82f6')
     
-    db = get_db()
-    c = db.cursor()
-    c.execute('''UPDATE calendar_events 
+    run_write(lambda conn: conn.execute('''UPDATE calendar_events 
                  SET title = ?, description = ?, start_time = ?, end_time = ?, color = ?
                  WHERE id = ? AND user_id = ?''',
-              (title, description, start_time, end_time, color, event_id, user_id))
-    db.commit()
+              (title, description, start_time, end_time, color, event_id, user_id)))
     return jsonify({'message': 'Event updated successfully'})
 
 @bp.route('/events/<int:event_id>', methods=['DELETE'])
 @login_required
 def delete_calendar_event(event_id):
     user_id = session['user_id']
-    db = get_db()
-    c = db.cursor()
-    c.execute('DELETE FROM calendar_events WHERE id = ? AND user_id = ?', (event_id, user_id))
-    db.commit()
+    run_write(lambda conn: conn.execute('DELETE FROM calendar_events WHERE id = ? AND user_id = ?', (event_id, user_id)))
     return jsonify({'message': 'Event deleted successfully'})
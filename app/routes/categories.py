@@ -1,24 +1,22 @@
 import sqlite3
 from flask import Blueprint, request, jsonify
 from app.db import get_db
-from app.utils import login_required, admin_required
+from app.writer import run_write
+from app.cache import get_categories_cached
+from app.utils import login_required, admin_required, conditional_get
 
 bp = Blueprint('categories', __name__, url_prefix='/api/categories')
 
 @bp.route('', methods=['GET'])
 @login_required
+@conditional_get('categories', shared=True)
 def get_categories():
     trans_type = request.args.get('type', 'all')
     
-    db = get_db()
-    c = db.cursor()
+    categories = get_categories_cached(get_db())
     
-    if trans_type == 'all':
-        c.execute('SELECT * FROM categories ORDER BY type, name')
-    else:
-        c.execute('SELECT * FROM categories WHERE type = ? ORDER BY name', (trans_type,))
-    
-    categories = [dict(row) for row in c.fetchall()]
+    if trans_type != 'all':
+        categories = [cat for cat in categories if cat['type'] == trans_type]
     
     return jsonify(categories)
 
@@ -34,34 +32,50 @@ def add_category():
     if data['type'] not in ['income', 'expense']:
         return jsonify({'error': 'Type must be income or expense'}), 400
     
-    db = get_db()
-    c = db.cursor()
-    
     try:
-        c.execute('INSERT INTO categories (name, type, icon) VALUES (?, ?, ?)',
-                  (data['name'], data['type'], data.get('icon', '📦')))
-        db.commit()
-        category_id = c.lastrowid
+        category_id = run_write(lambda conn: conn.execute(
+            'INSERT INTO categories (name, type, icon) VALUES (?, ?, ?)',
+            (data['name'], data['type'], data.get('icon', '📦'))).lastrowid)
         return jsonify({'id': category_id, 'message': 'Category added successfully'}), 201
     except sqlite3.IntegrityError:
         return jsonify({'error': 'Category already exists'}), 400
 
+@bp.route('/<int:category_id>', methods=['PUT'])
+@login_required
+@admin_required
+def update_category(category_id):
+    data = request.json
+    
+    if not data.get('name'):
+        return jsonify({'error': 'Name is required'}), 400
+    
+    # Transactions reference the id, so a rename touches only this row
+    try:
+        updated = run_write(lambda conn: conn.execute(
+            'UPDATE categories SET name = ?, icon = COALESCE(?, icon) WHERE id = ?',
+            (data['name'], data.get('icon'), category_id)).rowcount)
+    except sqlite3.IntegrityError:
+        return jsonify({'error': 'Category already exists'}), 400
+    
+    if not updated:
+        return jsonify({'error': 'Category not found'}), 404
+    
+    return jsonify({'message': 'Category updated successfully'})
+
 @bp.route('/<int:category_id>', methods=['DELETE'])
 @login_required
 @admin_required
 def delete_category(category_id):
-    db = get_db()
-    c = db.cursor()
-    
-    # Check if category is in use
-    c.execute('SELECT COUNT(*) as count FROM transactions WHERE category IN (SELECT name FROM categories WHERE id = ?)', 
-              (category_id,))
-    count = c.fetchone()['count']
+    def _delete(conn):
+        # Check if category is in use (one probe of idx_transactions_category)
+        in_use = conn.execute('SELECT 1 FROM transactions WHERE category_id = ? LIMIT 1',
+                              (category_id,)).fetchone()
+        if in_use:
+            return False
+        conn.execute('DELETE FROM categories WHERE id = ?', (category_id,))
+        return True
     
-    if count > 0:
+    if not run_write(_delete):
         return jsonify({'error': 'Cannot delete category that is in use'}), 400
     
-    c.execute('DELETE FROM categories WHERE id = ?', (category_id,))
-    db.commit()
-    
     return jsonify({'message': 'Category deleted successfully'})
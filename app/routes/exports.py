@@ -0,0 +1,295 @@
+import os
+import io
+import csv
+import json
+import time
+import tempfile
+from datetime import datetime
+from importlib.util import find_spec
+from flask import Blueprint, request, jsonify, session, current_app, send_file, url_for
+from app.db import get_db
+from app.writer import run_write
+from app import jobs
+from app.utils import login_required, admin_required
+from app.routes.transactions import transaction_filters, CSV_EXPORT_HEADER, CSV_EXPORT_QUERY
+
+bp = Blueprint('exports', __name__, url_prefix='/api/exports')
+
+# Exports are written to a file by a background job, so a year-end export
+# no longer holds a web worker for minutes and survives a dropped
+# connection. The client polls for progress and downloads the finished
+# file, resuming with Range requests if the transfer breaks.
+
+# Content type of each export format
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+}
+# Formats written through pyarrow, which is optional
+ARROW_FORMATS = ('parquet', 'arrow')
+EXPORT_FILTERS = ('type', 'category', 'start_date', 'end_date')
+EXPORT_BATCH_SIZE = 1000
+ORDER_BY = ' ORDER BY day DESC, id DESC'
+
+# Typed columns for JSONL, Parquet and Arrow: the date as a real date,
+# the amount as a number and type/category dictionary-encoded, since a
+# handful of values repeat on every row
+COLUMNAR_EXPORT_COLUMNS = ['id', 'date', 'day', 'user', 'type', 'category', 'description', 'amount']
+COLUMNAR_EXPORT_QUERY = '''SELECT id, date, day, username, type,
+                                  (SELECT name FROM categories WHERE id = category_id),
+                                  description, amount
+                           FROM transactions WHERE 1=1'''
+# Seconds between progress updates, so a large export costs a handful of
+# writes rather than one per batch
+EXPORT_PROGRESS_INTERVAL = 1.0
+
+def _export_path(file_name):
+    return os.path.join(current_app.config['EXPORT_FOLDER'], file_name)
+
+def _serialize_export(row):
+    export = {
+        'id': row['id'],
+        'status': row['status'],
+        'format': row['format'],
+        'filters': json.loads(row['filters']),
+        'total_rows': row['total_rows'],
+        'rows_written': row['rows_written'],
+        'progress': 0,
+        'file_size': row['file_size'],
+        'error': row['error'],
+        'created_at': datetime.fromtimestamp(row['created_at']).isoformat(timespec='seconds'),
+    }
+    if row['status'] == 'done':
+        export['progress'] = 100
+        export['download_url'] = url_for('exports.download_export', export_id=row['id'])
+    elif row['total_rows']:
+        export['progress'] = min(99, row['rows_written'] * 100 // row['total_rows'])
+    return export
+
+def _set_status(export_id, **fields):
+    assignments = ', '.join(f'{column} = ?' for column in fields)
+    run_write(lambda conn: conn.execute(f'UPDATE exports SET {assignments} WHERE id = ?',
+                                        list(fields.values()) + [export_id]))
+
+def _purge_expired():
+    """Remove finished exports older than EXPORT_RETENTION_DAYS, files first"""
+    cutoff = time.time() - current_app.config.get('EXPORT_RETENTION_DAYS', 7) * 86400
+    expired = get_db().execute('''SELECT id, file_name FROM exports
+                                  WHERE status IN ('done', 'failed') AND created_at < ?''', (cutoff,)).fetchall()
+    for row in expired:
+        if row['file_name']:
+            try:
+                os.remove(_export_path(row['file_name']))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error deleting export: {e}")
+                continue
+        run_write(lambda conn, export_id=row['id']: conn.execute('DELETE FROM exports WHERE id = ?', (export_id,)))
+
+def _batches(cursor):
+    while True:
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+        if not rows:
+            break
+        yield rows
+
+def _write_csv(f, db, where, params, progress):
+    text = io.TextIOWrapper(f, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(CSV_EXPORT_HEADER)
+    for rows in _batches(db.execute(CSV_EXPORT_QUERY + where + ORDER_BY, params)):
+        writer.writerows(rows)
+        progress(len(rows))
+    text.flush()
+    text.detach()
+
+def _frames(db, where, params, progress):
+    """Yield the export a cursor batch at a time as typed DataFrames"""
+    import pandas as pd
+
+    # The same category list for every batch, so they all share one
+    # dictionary (Arrow files cannot change it between batches)
+    categories = [row[0] for row in db.execute('SELECT name FROM categories ORDER BY id')]
+    for rows in _batches(db.execute(COLUMNAR_EXPORT_QUERY + where + ORDER_BY, params)):
+        frame = pd.DataFrame.from_records(rows, columns=COLUMNAR_EXPORT_COLUMNS)
+        frame['type'] = pd.Categorical(frame['type'], categories=['expense', 'income'])
+        frame['category'] = pd.Categorical(frame['category'], categories=categories)
+        frame['amount'] = frame['amount'] / 100
+        yield frame
+        progress(len(rows))
+
+def _write_jsonl(f, db, where, params, progress):
+    for frame in _frames(db, where, params, progress):
+        frame = frame.drop(columns='day')
+        # One JSON object per line, newline-terminated
+        f.write(frame.to_json(orient='records', lines=True, force_ascii=False).encode('utf-8'))
+
+def _arrow_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('id', pa.int64()),
+        ('date', pa.date32()),
+        ('user', pa.string()),
+        ('type', pa.dictionary(pa.int8(), pa.string())),
+        ('category', pa.dictionary(pa.int32(), pa.string())),
+        ('description', pa.string()),
+        ('amount', pa.float64()),
+    ])
+
+def _record_batches(db, where, params, progress, schema):
+    import pandas as pd
+    import pyarrow as pa
+
+    for frame in _frames(db, where, params, progress):
+        # day counts days since 1970-01-01, which is exactly Arrow's date32
+        frame['date'] = pd.to_datetime(frame.pop('day'), unit='D')
+        yield pa.RecordBatch.from_pandas(frame, schema=schema, preserve_index=False)
+
+def _write_parquet(f, db, where, params, progress):
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema()
+    # One row group per batch keeps memory flat however long the export
+    with pq.ParquetWriter(f, schema, use_dictionary=['type', 'category', 'user'], compression='zstd') as writer:
+        for batch in _record_batches(db, where, params, progress, schema):
+            writer.write_batch(batch)
+
+def _write_arrow(f, db, where, params, progress):
+    import pyarrow as pa
+
+    schema = _arrow_schema()
+    with pa.ipc.new_file(f, schema) as writer:
+        for batch in _record_batches(db, where, params, progress, schema):
+            writer.write_batch(batch)
+
+_EXPORT_WRITERS = {
+    'csv': _write_csv,
+    'jsonl': _write_jsonl,
+    'parquet': _write_parquet,
+    'arrow': _write_arrow,
+}
+
+@jobs.job(max_attempts=3)
+def generate_export(export_id):
+    """Write an export's file from its saved filters, reporting progress as it goes"""
+    db = get_db()
+    export = db.execute('SELECT * FROM exports WHERE id = ?', (export_id,)).fetchone()
+    if export is None or export['status'] == 'done':
+        return None
+
+    params = []
+    where = transaction_filters(json.loads(export['filters']), params)
+    total_rows = db.execute(f'SELECT COUNT(*) FROM transactions WHERE 1=1{where}', params).fetchone()[0]
+    # A retry starts the file over
+    _set_status(export_id, status='running', total_rows=total_rows, rows_written=0, error=None)
+
+    last_report = time.monotonic()
+    rows_written = 0
+
+    def _progress(rows):
+        nonlocal rows_written, last_report
+        rows_written += rows
+        if time.monotonic() - last_report >= EXPORT_PROGRESS_INTERVAL:
+            _set_status(export_id, rows_written=rows_written)
+            last_report = time.monotonic()
+
+    folder = current_app.config['EXPORT_FOLDER']
+    file_name = f'export_{export_id}.{export["format"]}'
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            _EXPORT_WRITERS[export['format']](f, db, where, params, _progress)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, os.path.join(folder, file_name))
+    except Exception as e:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        _set_status(export_id, status='failed', error=str(e))
+        raise
+
+    _set_status(export_id, status='done', rows_written=rows_written, file_name=file_name,
+                file_size=os.path.getsize(os.path.join(folder, file_name)), finished_at=time.time())
+    _purge_expired()
+    return {'rows': rows_written}
+
+@bp.route('', methods=['POST'])
+@login_required
+@admin_required
+def create_export():
+    data = request.get_json(silent=True) or {}
+    export_format = data.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Format must be one of: {", ".join(EXPORT_FORMATS)}'}), 400
+    if export_format in ARROW_FORMATS and find_spec('pyarrow') is None:
+        return jsonify({'error': f'{export_format} exports need pyarrow installed on the server'}), 400
+
+    # Saved as given so the export uses the filters of the moment it was asked for
+    filters = {name: str(data[name]) for name in EXPORT_FILTERS if data.get(name)}
+    try:
+        transaction_filters(filters, [])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    user_id = session['user_id']
+
+    def _create(conn):
+        export_id = conn.execute('''INSERT INTO exports (user_id, format, filters, created_at)
+                                    VALUES (?, ?, ?, ?)''',
+                                 (user_id, export_format, json.dumps(filters), time.time())).lastrowid
+        # Queued in the same transaction, so there is never an export without its job
+        job_id = jobs.enqueue(generate_export.job_name, [export_id], conn=conn)
+        conn.execute('UPDATE exports SET job_id = ? WHERE id = ?', (job_id, export_id))
+        return export_id
+
+    export_id = run_write(_create)
+    jobs.notify()
+
+    row = get_db().execute('SELECT * FROM exports WHERE id = ?', (export_id,)).fetchone()
+    response = jsonify(_serialize_export(row))
+    response.status_code = 202
+    response.headers['Location'] = url_for('exports.get_export', export_id=export_id)
+    return response
+
+def _get_own_export(export_id):
+    return get_db().execute('SELECT * FROM exports WHERE id = ? AND user_id = ?',
+                            (export_id, session['user_id'])).fetchone()
+
+@bp.route('/<int:export_id>', methods=['GET'])
+@login_required
+@admin_required
+def get_export(export_id):
+    row = _get_own_export(export_id)
+    if not row:
+        return jsonify({'error': 'Export not found'}), 404
+
+    export = _serialize_export(row)
+    if row['status'] in ('queued', 'running') and row['job_id']:
+        # The job gave up without reaching the export (its worker kept dying)
+        job = jobs.get_job(row['job_id'])
+        if job is not None and job['status'] == 'failed':
+            export['status'] = 'failed'
+            export['error'] = job['error']
+    return jsonify(export)
+
+@bp.route('/<int:export_id>/download', methods=['GET'])
+@login_required
+@admin_required
+def download_export(export_id):
+    row = _get_own_export(export_id)
+    if not row or row['status'] != 'done':
+        return jsonify({'error': 'Export not found'}), 404
+
+    file_path = _export_path(row['file_name'])
+    if not os.path.isfile(file_path):
+        return jsonify({'error': 'Export not found'}), 404
+
+    created = datetime.fromtimestamp(row['created_at'])
+    # conditional=True answers Range and If-Range, so a broken download resumes
+    return send_file(file_path, mimetype=EXPORT_FORMATS[row['format']], as_attachment=True, conditional=True,
+                     download_name=f'transactions_{created.strftime("%Y%m%d_%H%M%S")}.{row["format"]}')
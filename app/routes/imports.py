@@ -0,0 +1,191 @@
+import io
+import re
+import csv
+import json
+import pickle
+import tempfile
+from datetime import datetime
+from flask import Blueprint, request, jsonify, session
+from app.db import get_db
+from app.cache import category_ids
+from app.writer import run_write
+from app.utils import login_required, to_minor_units, date_columns
+
+bp = Blueprint('imports', __name__, url_prefix='/api')
+
+IMPORT_FIELDS = ('amount', 'type', 'category', 'description', 'date')
+# Parsed rows are held in memory this many at a time, then spooled
+IMPORT_BATCH_SIZE = 2000
+# Spooled rows stay in memory up to this size before going to a temp file
+IMPORT_SPOOL_MEMORY = 4 * 1024 * 1024
+# Keep the error report bounded even for a file that is entirely invalid
+MAX_REPORTED_ERRORS = 1000
+
+_OFX_FIELD = re.compile(r'<(TRNTYPE|DTPOSTED|TRNAMT|NAME|MEMO)>([^<\r\n]*)', re.IGNORECASE)
+
+def _parse_amount(value):
+    """Statement amount in signed integer paise"""
+    value = (value or '').strip().replace(',', '').replace('₹', '').replace(' ', '')
+    return to_minor_units(value)
+
+def _parse_date(value, date_format):
+    value = (value or '').strip()
+    if not value:
+        raise ValueError('Missing date')
+    try:
+        return datetime.strptime(value, date_format).strftime('%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'Invalid date: {value}')
+
+def _iter_csv(stream, mapping):
+    """Yield (line, fields) for each CSV record, reading the upload incrementally"""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    headers = {name.strip().lower(): name for name in (reader.fieldnames or [])}
+
+    # Explicit mapping wins, otherwise match headers by field name
+    columns = {}
+    for field in IMPORT_FIELDS:
+        column = mapping.get(field) or headers.get(field)
+        if column:
+            columns[field] = column
+
+    for record in reader:
+        yield reader.line_num, {field: (record.get(column) or '').strip() for field, column in columns.items()}
+
+def _iter_ofx(stream):
+    """Yield (line, fields) for each <STMTTRN> in an OFX statement"""
+    current = None
+    start_line = 0
+    for line_num, raw in enumerate(io.TextIOWrapper(stream, encoding='utf-8', errors='replace'), start=1):
+        upper = raw.upper()
+        if '<STMTTRN>' in upper:
+            current = {}
+            start_line = line_num
+        if current is not None:
+            for tag, value in _OFX_FIELD.findall(raw):
+                current[tag.upper()] = value.strip()
+        if '</STMTTRN>' in upper and current is not None:
+            fields = {
+                'amount': current.get('TRNAMT', ''),
+                'description': current.get('NAME') or current.get('MEMO', ''),
+                # DTPOSTED is YYYYMMDD optionally followed by a time and zone
+                'date': current.get('DTPOSTED', '')[:8],
+            }
+            current = None
+            yield start_line, fields
+
+def _insert_spooled(conn, spool):
+    """Insert every batch of prepared rows pickled into spool"""
+    spool.seek(0)
+    while True:
+        try:
+            batch = pickle.load(spool)
+        except EOFError:
+            return
+        conn.executemany('''INSERT INTO transactions
+                            (user_id, username, amount, type, category_id, description, date, day, month)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', batch)
+
+@bp.route('/transactions/import', methods=['POST'])
+@login_required
+def import_transactions():
+    user_id = session['user_id']
+    username = session['username']
+
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'error': 'No file uploaded'}), 400
+
+    try:
+        mapping = json.loads(request.form.get('mapping') or '{}')
+    except ValueError:
+        return jsonify({'error': 'Invalid mapping'}), 400
+    # Field name to column header, e.g. {"amount": "Debit"}
+    if not isinstance(mapping, dict) or not all(isinstance(column, str) for column in mapping.values()):
+        return jsonify({'error': 'Invalid mapping'}), 400
+    date_format = request.form.get('date_format') or '%Y-%m-%d'
+
+    # Statements carry no categories, so the caller picks one per type
+    default_categories = {
+        'expense': request.form.get('expense_category'),
+        'income': request.form.get('income_category'),
+    }
+
+    if file.filename.lower().endswith(('.ofx', '.qfx')):
+        records = _iter_ofx(file.stream)
+        date_format = '%Y%m%d'
+    else:
+        records = _iter_csv(file.stream, mapping)
+
+    db = get_db()
+    valid_categories = {
+        'expense': category_ids(db, 'expense'),
+        'income': category_ids(db, 'income'),
+    }
+
+    errors = []
+    error_count = 0
+
+    def report(row, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'row': row, 'error': message})
+
+    # Parse and validate here, on the request thread, spooling the prepared
+    # rows a batch at a time; the writer only has inserts left to run and
+    # memory stays bounded however long the statement is
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MEMORY)
+    with spool:
+        batch = []
+        imported = 0
+        try:
+            for line, fields in records:
+                try:
+                    amount = _parse_amount(fields.get('amount'))
+                    # Without a type column the sign decides: negative is money out
+                    trans_type = (fields.get('type') or ('expense' if amount < 0 else 'income')).lower()
+                    if trans_type not in valid_categories:
+                        raise ValueError(f'Invalid type: {trans_type}')
+                    amount = abs(amount)
+                    if amount == 0:
+                        raise ValueError('Amount must be non-zero')
+
+                    category = fields.get('category') or default_categories[trans_type]
+                    if not category:
+                        raise ValueError('Missing category')
+                    if category not in valid_categories[trans_type]:
+                        raise ValueError(f'Invalid category: {category}')
+
+                    date, day, month = date_columns(_parse_date(fields.get('date'), date_format))
+                except ValueError as e:
+                    report(line, str(e))
+                    continue
+
+                batch.append((user_id, username, amount, trans_type, valid_categories[trans_type][category],
+                              fields.get('description', ''), date, day, month))
+                imported += 1
+                if len(batch) == IMPORT_BATCH_SIZE:
+                    pickle.dump(batch, spool)
+                    batch = []
+        except (UnicodeDecodeError, csv.Error) as e:
+            return jsonify({'error': f'Could not read file: {e}'}), 400
+        if batch:
+            pickle.dump(batch, spool)
+
+        # One transaction for the whole file: other readers never see half
+        # an import, and a failure or a killed worker leaves nothing behind.
+        # Other writes in this worker wait while it runs.
+        if imported:
+            try:
+                run_write(lambda conn: _insert_spooled(conn, spool))
+            except Exception as e:
+                print(f"Error importing transactions: {e}")
+                return jsonify({'error': f'Import failed, nothing was imported: {e}'}), 500
+
+    return jsonify({
+        'imported': imported,
+        'error_count': error_count,
+        'errors': errors,
+        'message': f'Imported {imported} transactions'
+    }), 201
@@ -1,11 +1,13 @@
 from flask import Blueprint, request, jsonify, session
 from app.db import get_db
-from app.utils import login_required
+from app.writer import run_write
+from app.utils import login_required, conditional_get
 
 bp = Blueprint('notes', __name__, url_prefix='/api/notes')
 
 @bp.route('', methods=['GET'])
 @login_required
+@conditional_get('notes')
 def get_notes():
     user_id = session['user_id']
     db = get_db()
@@ -26,12 +28,9 @@ def add_note():
     if not title:
         return jsonify({'error': 'Title is required'}), 400
         
-    db = get_db()
-    c = db.cursor()
-    c.execute('INSERT INTO notes (user_id, title, content, color) VALUES (?, ?, ?, ?)',
-              (user_id, title, content, color))
-    db.commit()
-    note_id = c.lastrowid
+    note_id = run_write(lambda conn: conn.execute(
+        'INSERT INTO notes (user_id, title, content, color) VALUES (?, ?, ?, ?)',
+        (user_id, title, content, color)).lastrowid)
     return jsonify({'id': note_id, 'message': 'Note added successfully'}), 201
 
 @bp.route('/<int:note_id>', methods=['PUT'])
@@ -43,21 +42,15 @@ def update_note(note_id):
     content = data.get('content', '')
     color = data.get('color', '#ffffff')
     
-    db = get_db()
-    c = db.cursor()
-    c.execute('''UPDATE notes 
+    run_write(lambda conn: conn.execute('''UPDATE notes 
                  SET title = ?, content = ?, color = ?, updated_at = CURRENT_TIMESTAMP 
                  WHERE id = ? AND user_id = ?''',
-              (title, content, color, note_id, user_id))
-    db.commit()
+              (title, content, color, note_id, user_id)))
     return jsonify({'message': 'Note updated successfully'})
 
 @bp.route('/<int:note_id>', methods=['DELETE'])
 @login_required
 def delete_note(note_id):
     user_id = session['user_id']
-    db = get_db()
-    c = db.cursor()
-    c.execute('DELETE FROM notes WHERE id = ? AND user_id = ?', (note_id, user_id))
-    db.commit()
+    run_write(lambda conn: conn.execute('DELETE FROM notes WHERE id = ? AND user_id = ?', (note_id, user_id)))
     return jsonify({'message': 'Note deleted successfully'})
@@ -1,11 +1,13 @@
 from flask import Blueprint, request, jsonify, session
 from app.db import get_db
-from app.utils import login_required
+from app.writer import run_write
+from app.utils import login_required, conditional_get
 
 bp = Blueprint('reminders', __name__, url_prefix='/api/reminders')
 
 @bp.route('', methods=['GET'])
 @login_required
+@conditional_get('reminders')
 def get_reminders():
     user_id = session['user_id']
     db = get_db()
@@ -26,12 +28,9 @@ def add_reminder():
     if not title:
         return jsonify({'error': 'Title is required'}), 400
         
-    db = get_db()
-    c = db.cursor()
-    c.execute('INSERT INTO reminders (user_id, title, description, due_date) VALUES (?, ?, ?, ?)',
-              (user_id, title, description, due_date))
-    db.commit()
-    reminder_id = c.lastrowid
+    reminder_id = run_write(lambda conn: conn.execute(
+        'INSERT INTO reminders (user_id, title, description, due_date) VALUES (?, ?, ?, ?)',
+        (user_id, title, description, due_date)).lastrowid)
     return jsonify({'id': reminder_id, 'message': 'Reminder added successfully'}), 201
 
 @bp.route('/<int:reminder_id>', methods=['PUT'])
@@ -44,27 +43,22 @@ def update_reminder(reminder_id):
     due_date = data.get('due_date')
     is_completed = data.get('is_completed')
     
-    db = get_db()
-    c = db.cursor()
+    def _update(conn):
+        if is_completed is not None:
+            conn.execute('UPDATE reminders SET is_completed = ? WHERE id = ? AND user_id = ?',
+                         (is_completed, reminder_id, user_id))
+        else:
+            conn.execute('''UPDATE reminders 
+                         SET title = ?, description = ?, due_date = ?
+                         WHERE id = ? AND user_id = ?''',
+                      (title, description, due_date, reminder_id, user_id))
     
-    if is_completed is not None:
-        c.execute('UPDATE reminders SET is_completed = ? WHERE id = ? AND user_id = ?',
-                  (is_completed, reminder_id, user_id))
-    else:
-        c.execute('''UPDATE reminders 
-                     SET title = ?, description = ?, due_date = ?
-                     WHERE id = ? AND user_id = ?''',
-                  (title, description, due_date, reminder_id, user_id))
-    
-    db.commit()
+    run_write(_update)
     return jsonify({'message': 'Reminder updated successfully'})
 
 @bp.route('/<int:reminder_id>', methods=['DELETE'])
 @login_required
 def delete_reminder(reminder_id):
     user_id = session['user_id']
-    db = get_db()
-    c = db.cursor()
-    c.execute('DELETE FROM reminders WHERE id = ? AND user_id = ?', (reminder_id, user_id))
-    db.commit()
+    run_write(lambda conn: conn.execute('DELETE FROM reminders WHERE id = ? AND user_id = ?', (reminder_id, user_id)))
     return jsonify({'message': 'Reminder deleted successfully'})
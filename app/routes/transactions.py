@@ -1,61 +1,173 @@
 import os
 import io
 import csv
-from datetime import datetime
-from flask import Blueprint, request, jsonify, session, current_app, make_response, send_from_directory
-from werkzeug.utils import secure_filename
+import base64
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, session, current_app, Response, stream_with_context
 from app.db import get_db
-from app.utils import login_required, admin_required, allowed_file, secure_filename_custom
+from app.cache import category_ids, category_labels
+from app.writer import run_write
+from app import attachments, previews
+from app.utils import login_required, admin_required, allowed_file, conditional_get, to_minor_units, from_minor_units, parse_date, to_day_number, date_columns, scoped_user_id
 
 bp = Blueprint('transactions', __name__, url_prefix='/api')
 
+TRANSACTIONS_PAGE_SIZE = 50
+TRANSACTIONS_MAX_PAGE_SIZE = 200
+
+def transaction_filters(args, params):
+    """Append the type/category/date filters from the query string to a WHERE clause
+
+    Raises ValueError for a malformed start_date or end_date.
+    """
+    query = ''
+    trans_type = args.get('type')
+    category = args.get('category')
+    start_date = args.get('start_date')
+    end_date = args.get('end_date')
+
+    if trans_type and trans_type != 'all':
+        query += ' AND type = ?'
+        params.append(trans_type)
+
+    if category and category != 'all':
+        query += ' AND category_id = (SELECT id FROM categories WHERE name = ?)'
+        params.append(category)
+
+    # Range scans over the integer day column
+    if start_date:
+        query += ' AND day >= ?'
+        params.append(to_day_number(start_date))
+
+    if end_date:
+        query += ' AND day <= ?'
+        params.append(to_day_number(end_date))
+
+    return query
+
+def _scoped_filters(role, user_id, args, params):
+    """WHERE clause for the caller's visible transactions plus query string filters"""
+    # Admin sees all transactions, users see only their own
+    if role == 'admin':
+        query = '1=1'
+    else:
+        query = 'user_id = ?'
+        params.append(user_id)
+    
+    return query + transaction_filters(args, params)
+
+def _serialize_transaction(row, labels):
+    transaction = dict(row)
+    transaction['amount'] = from_minor_units(transaction['amount'])
+    transaction['category'] = labels.get(transaction['category_id'])
+    # Derived columns; date already carries the same information
+    transaction.pop('day', None)
+    transaction.pop('month', None)
+    return transaction
+
+def _encode_cursor(row):
+    raw = f"{row['day']}|{row['id']}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        day, trans_id = raw.split('|')
+        return int(day), int(trans_id)
+    except (ValueError, UnicodeError):
+        return None
+
 @bp.route('/transactions', methods=['GET'])
 @login_required
+@conditional_get('transactions', 'categories', admin_sees_all=True)
 def get_transactions():
     user_id = session['user_id']
     role = session['role']
     db = get_db()
     c = db.cursor()
     
-    # Get filter parameters
-    trans_type = request.args.get('type')
-    category = request.args.get('category')
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
+    # Page size, capped so a single request never pulls the whole ledger
+    try:
+        limit = int(request.args.get('limit', TRANSACTIONS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    limit = max(1, min(limit, TRANSACTIONS_MAX_PAGE_SIZE))
     
-    # Admin sees all transactions, users see only their own
-    if role == 'admin':
-        query = 'SELECT * FROM transactions WHERE 1=1'
-        params = []
-    else:
-        query = 'SELECT * FROM transactions WHERE user_id = ?'
-        params = [user_id]
+    params = []
+    try:
+        where = _scoped_filters(role, user_id, request.args, params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    query = 'SELECT * FROM transactions WHERE ' + where
+    
+    # Keyset pagination: continue strictly after the last (day, id) seen
+    cursor = request.args.get('cursor')
+    if cursor:
+        position = _decode_cursor(cursor)
+        if position is None:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query += ' AND day <= ? AND (day < ? OR id < ?)'
+        params.extend([position[0], position[0], position[1]])
+    
+    # Fetch one extra row to know whether another page exists
+    query += ' ORDER BY day DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
     
-    if trans_type and trans_type != 'all':
-        query += ' AND type = ?'
-        params.append(trans_type)
+    c.execute(query, params)
+    rows = c.fetchall()
     
-    if category and category != 'all':
-        query += ' AND category = ?'
-        params.append(category)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1])
     
-    if start_date:
-        query += ' AND date >= ?'
-        params.append(start_date)
+    # Names come from the per-worker category cache rather than a SQL join
+    labels = category_labels(db)
+    transactions = [_serialize_transaction(row, labels) for row in rows]
     
-    if end_date:
-        query += ' AND date <= ?'
-        params.append(end_date)
+    response = jsonify({'transactions': transactions, 'next_cursor': next_cursor})
     
-    query += ' ORDER BY date DESC, id DESC'
+    # Optional total across all pages, counted in SQL under the same filters
+    if request.args.get('include_total') in ('1', 'true'):
+        count_params = []
+        count_where = _scoped_filters(role, user_id, request.args, count_params)
+        c.execute('SELECT COUNT(*) as count FROM transactions WHERE ' + count_where, count_params)
+        response.headers['X-Total-Count'] = str(c.fetchone()['count'])
     
-    c.execute(query, params)
-    transactions = [dict(row) for row in c.fetchall()]
+    return response
+
+@bp.route('/transactions/summary', methods=['GET'])
+@login_required
+@conditional_get('transactions', 'categories', admin_sees_all=True)
+def get_transactions_summary():
+    user_id = session['user_id']
+    role = session['role']
+    db = get_db()
+    c = db.cursor()
     
-    return jsonify(transactions)
+    params = []
+    try:
+        where = _scoped_filters(role, user_id, request.args, params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Counts and sums in one pass over the filtered rows
+    c.execute('''SELECT COUNT(*) as count,
+                        COALESCE(SUM(type = 'income'), 0) as income_count,
+                        COALESCE(SUM(type = 'expense'), 0) as expense_count,
+                        COALESCE(SUM(CASE WHEN type = 'income' THEN amount END), 0) as total_income,
+                        COALESCE(SUM(CASE WHEN type = 'expense' THEN amount END), 0) as total_expenses
+                 FROM transactions WHERE ''' + where, params)
+    summary = dict(c.fetchone())
+    summary['balance'] = from_minor_units(summary['total_income'] - summary['total_expenses'])
+    summary['total_income'] = from_minor_units(summary['total_income'])
+    summary['total_expenses'] = from_minor_units(summary['total_expenses'])
+    
+    return jsonify(summary)
 
 @bp.route('/transactions', methods=['POST'])
 @login_required
+@attachments.streamed_upload
 def add_transaction():
     user_id = session['user_id']
     username = session['username']
@@ -79,30 +191,55 @@ def add_transaction():
             description = data.get('description', '')
             date = data.get('date')
 
+        # Validate
+        if not all([amount, trans_type, category, date]):
+            return jsonify({'error': 'Missing required fields'}), 400
+
+        try:
+            amount = _parse_positive_amount(amount)
+            date, day, month = date_columns(date)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        db = get_db()
+
+        category_id = category_ids(db, trans_type).get(category)
+        if category_id is None:
+            return jsonify({'error': 'Invalid category'}), 400
+
         # Handle attachment
         attachment_filename = None
         attachment_path = None
+        attachment_size = None
+        staged = None
         if file and file.filename and allowed_file(file.filename):
-            filename = secure_filename_custom(file.filename)
-            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            try:
+                staged = attachments.stage_upload(file)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             attachment_filename = file.filename
-            attachment_path = filename
+            attachment_path = staged.store_path
+            attachment_size = staged.size
 
-        # Validate
-        if not all([amount, trans_type, category, date]):
-            return jsonify({'error': 'Missing required fields'}), 400
+        def _insert(conn):
+            # Place the file under the write lock, next to the row that references it
+            if staged:
+                attachments.commit_staged(staged)
+            return conn.execute('''INSERT INTO transactions 
+                     (user_id, username, amount, type, category_id, description, date, day, month,
+                      attachment_filename, attachment_path, attachment_size)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                  (user_id, username, amount, trans_type, category_id, description, date, day, month,
+                   attachment_filename, attachment_path, attachment_size)).lastrowid
 
-        db = get_db()
-        c = db.cursor()
-        c.execute('''INSERT INTO transactions 
-                     (user_id, username, amount, type, category, description, date, 
-                      attachment_filename, attachment_path)
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                  (user_id, username, amount, trans_type, category, description, date,
-                   attachment_filename, attachment_path))
-        db.commit()
-        transaction_id = c.lastrowid
+        try:
+            transaction_id = run_write(_insert)
+        finally:
+            if staged:
+                attachments.discard_staged(staged.temp_path)
+
+        if staged:
+            previews.schedule(staged.store_path)
 
         return jsonify({'id': transaction_id, 'message': 'Transaction added successfully'}), 201
 
@@ -113,6 +250,7 @@ def add_transaction():
 
 @bp.route('/transactions/<int:transaction_id>', methods=['PUT'])
 @login_required
+@attachments.streamed_upload
 def update_transaction(transaction_id):
     user_id = session['user_id']
     username = session['username']
@@ -147,39 +285,71 @@ def update_transaction(transaction_id):
         description = data.get('description', '')
         date = data.get('date')
 
+    # Validate
+    if not all([amount, trans_type, category, date]):
+        return jsonify({'error': 'Missing required fields'}), 400
+    # category_ids() would match every category for a missing type
+    if trans_type not in ('income', 'expense'):
+        return jsonify({'error': 'Type must be income or expense'}), 400
+
+    try:
+        amount = _parse_positive_amount(amount)
+        date, day, month = date_columns(date)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    category_id = category_ids(db, trans_type).get(category)
+    if category_id is None:
+        return jsonify({'error': 'Invalid category'}), 400
+
     attachment_filename = old_attachment_filename
     attachment_path = old_attachment_path
+    attachment_size = old_trans['attachment_size']
 
     # Handle new file upload
+    staged = None
     if file and file.filename and allowed_file(file.filename):
-        # Delete old file if it exists
-        if old_attachment_path:
-            old_file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], old_attachment_path)
-            if os.path.exists(old_file_path):
-                os.remove(old_file_path)
-        filename = secure_filename_custom(file.filename)
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        try:
+            staged = attachments.stage_upload(file)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         attachment_filename = file.filename
-        attachment_path = filename
+        attachment_path = staged.store_path
+        attachment_size = staged.size
 
     # Update DB
-    if role == 'admin':
-        c.execute('''UPDATE transactions
-                     SET amount = ?, type = ?, category = ?, description = ?, date = ?, 
-                         user_id = ?, username = ?, attachment_filename = ?, attachment_path = ?
+    def _update(conn):
+        if staged:
+            attachments.commit_staged(staged)
+        if role == 'admin':
+            conn.execute('''UPDATE transactions
+                     SET amount = ?, type = ?, category_id = ?, description = ?, date = ?, day = ?, month = ?,
+                         user_id = ?, username = ?, attachment_filename = ?, attachment_path = ?,
+                         attachment_size = ?
                      WHERE id = ?''',
-                  (amount, trans_type, category, description, date,
-                   user_id, username, attachment_filename, attachment_path, transaction_id))
-    else:
-        c.execute('''UPDATE transactions
-                     SET amount = ?, type = ?, category = ?, description = ?, date = ?, 
-                         attachment_filename = ?, attachment_path = ?
+                  (amount, trans_type, category_id, description, date, day, month,
+                   user_id, username, attachment_filename, attachment_path, attachment_size,
+                   transaction_id))
+        else:
+            conn.execute('''UPDATE transactions
+                     SET amount = ?, type = ?, category_id = ?, description = ?, date = ?, day = ?, month = ?,
+                         attachment_filename = ?, attachment_path = ?, attachment_size = ?
                      WHERE id = ? AND user_id = ?''',
-                  (amount, trans_type, category, description, date,
-                   attachment_filename, attachment_path, transaction_id, user_id))
+                  (amount, trans_type, category_id, description, date, day, month,
+                   attachment_filename, attachment_path, attachment_size, transaction_id, user_id))
 
-    db.commit()
+    try:
+        run_write(_update)
+    finally:
+        if staged:
+            attachments.discard_staged(staged.temp_path)
+
+    if staged:
+        previews.schedule(staged.store_path)
+
+    # The old file goes only if no other transaction shares its content
+    if attachment_path != old_attachment_path:
+        attachments.release([old_attachment_path])
 
     return jsonify({'message': 'Transaction updated successfully'})
 
@@ -202,76 +372,308 @@ def delete_transaction(transaction_id):
     
     trans = c.fetchone()
     
-    if trans and trans['attachment_path']:
-        # Delete file from filesystem
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], trans['attachment_path'])
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-            except Exception as e:
-                print(f"Error deleting file: {e}")
-    
     # Admin can delete any transaction, users can only delete their own
     if role == 'admin':
-        c.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
+        run_write(lambda conn: conn.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,)))
     else:
-        c.execute('DELETE FROM transactions WHERE id = ? AND user_id = ?', 
-                  (transaction_id, user_id))
+        run_write(lambda conn: conn.execute('DELETE FROM transactions WHERE id = ? AND user_id = ?', 
+                                            (transaction_id, user_id)))
     
-    db.commit()
+    # Delete file from filesystem once its last row is gone
+    if trans:
+        attachments.release([trans['attachment_path']])
     
     return jsonify({'message': 'Transaction deleted successfully'})
 
+MAX_BATCH_OPERATIONS = 1000
+
+def _parse_positive_amount(value):
+    amount = to_minor_units(value)
+    if amount <= 0:
+        raise ValueError('Amount must be greater than zero')
+    return amount
+
+def _validate_transaction_fields(valid_categories, amount, trans_type, category, date):
+    """Return an error message for an invalid transaction, or None"""
+    if not all([amount, trans_type, category, date]):
+        return 'Missing required fields'
+    if category not in valid_categories.get(trans_type, ()):
+        return 'Invalid category'
+    return None
+
+def _prepare_operation(operation, valid_categories):
+    """Check one batch operation and parse its fields, raising ValueError if it is invalid"""
+    if not isinstance(operation, dict):
+        raise ValueError('Operation must be an object')
+    action = operation.get('op')
+    fields = operation.get('data')
+    if fields is None:
+        fields = {}
+    if not isinstance(fields, dict):
+        raise ValueError('data must be an object')
+    for key in ('type', 'category', 'description', 'date'):
+        if fields.get(key) is not None and not isinstance(fields[key], str):
+            raise ValueError(f'{key} must be a string')
+
+    if action == 'create':
+        error = _validate_transaction_fields(valid_categories, fields.get('amount'), fields.get('type'),
+                                             fields.get('category'), fields.get('date'))
+        if error:
+            raise ValueError(error)
+        prepared = {
+            'amount': _parse_positive_amount(fields['amount']),
+            'type': fields['type'],
+            'category_id': valid_categories[fields['type']][fields['category']],
+            'description': fields.get('description', ''),
+        }
+        prepared['date'], prepared['day'], prepared['month'] = date_columns(fields['date'])
+        return action, None, prepared
+
+    if action in ('update', 'delete'):
+        transaction_id = operation.get('id')
+        if not isinstance(transaction_id, int) or isinstance(transaction_id, bool):
+            raise ValueError('id must be an integer')
+        if action == 'delete':
+            return action, transaction_id, None
+        # Fields left out keep their current value
+        prepared = {key: fields[key] for key in ('type', 'category', 'description') if key in fields}
+        if 'amount' in fields:
+            prepared['amount'] = _parse_positive_amount(fields['amount'])
+        if 'date' in fields:
+            prepared['date'], prepared['day'], prepared['month'] = date_columns(fields['date'])
+        return action, transaction_id, prepared
+
+    raise ValueError(f'Unknown operation: {action}')
+
+class _BatchRejected(Exception):
+    def __init__(self, errors):
+        super().__init__('Batch rejected')
+        self.errors = errors
+
+@bp.route('/transactions/batch', methods=['POST'])
+@login_required
+def batch_transactions():
+    user_id = session['user_id']
+    username = session['username']
+    role = session['role']
+
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'operations must be a non-empty list'}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({'error': f'At most {MAX_BATCH_OPERATIONS} operations per batch'}), 400
+
+    db = get_db()
+    valid_categories = {
+        'expense': category_ids(db, 'expense'),
+        'income': category_ids(db, 'income'),
+    }
+    labels = category_labels(db)
+
+    # Everything that needs no stored row is checked here, before the writer
+    prepared = []
+    errors = []
+    for index, operation in enumerate(operations):
+        try:
+            prepared.append(_prepare_operation(operation, valid_categories))
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+    if errors:
+        return jsonify({'error': 'Batch rejected', 'errors': errors}), 400
+
+    # Runs as one unit on the writer connection, so the reads, ownership
+    # checks and writes all happen inside a single transaction
+    def _apply(conn):
+        results = []
+        errors = []
+        files_to_remove = []
+
+        for index, (action, transaction_id, fields) in enumerate(prepared):
+            if action == 'create':
+                cursor = conn.execute('''INSERT INTO transactions
+                                         (user_id, username, amount, type, category_id, description, date, day, month)
+                                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                      (user_id, username, fields['amount'], fields['type'], fields['category_id'],
+                                       fields['description'], fields['date'], fields['day'], fields['month']))
+                results.append({'index': index, 'op': action, 'id': cursor.lastrowid})
+                continue
+
+            # Admin can change any transaction, users can only change their own
+            if role == 'admin':
+                trans = conn.execute('SELECT * FROM transactions WHERE id = ?',
+                                     (transaction_id,)).fetchone()
+            else:
+                trans = conn.execute('SELECT * FROM transactions WHERE id = ? AND user_id = ?',
+                                     (transaction_id, user_id)).fetchone()
+            if not trans:
+                errors.append({'index': index, 'error': 'Transaction not found'})
+                continue
+
+            if action == 'update':
+                merged = {key: fields.get(key, trans[key])
+                          for key in ('amount', 'type', 'description', 'date', 'day', 'month')}
+                merged['category'] = fields.get('category', labels.get(trans['category_id']))
+                error = _validate_transaction_fields(valid_categories, merged['amount'], merged['type'],
+                                                     merged['category'], merged['date'])
+                if error:
+                    errors.append({'index': index, 'error': error})
+                    continue
+                conn.execute('''UPDATE transactions
+                                SET amount = ?, type = ?, category_id = ?, description = ?,
+                                    date = ?, day = ?, month = ?
+                                WHERE id = ?''',
+                             (merged['amount'], merged['type'],
+                              valid_categories[merged['type']][merged['category']],
+                              merged['description'], merged['date'], merged['day'], merged['month'],
+                              transaction_id))
+            else:
+                conn.execute('DELETE FROM transactions WHERE id = ?', (transaction_id,))
+                if trans['attachment_path']:
+                    files_to_remove.append(trans['attachment_path'])
+            results.append({'index': index, 'op': action, 'id': transaction_id})
+
+        # All or nothing: a single bad operation rejects the batch
+        if errors:
+            raise _BatchRejected(errors)
+        return results, files_to_remove
+
+    try:
+        results, files_to_remove = run_write(_apply)
+    except _BatchRejected as e:
+        return jsonify({'error': 'Batch rejected', 'errors': e.errors}), 400
+
+    # Only touch the filesystem once the rows are gone for good
+    attachments.release(files_to_remove)
+
+    return jsonify({'results': results, 'message': f'Applied {len(results)} operations'})
+
+def _month_number(day):
+    return day.year * 100 + day.month
+
+def _month_label(month):
+    # YYYYMM back to the YYYY-MM the API has always returned
+    return f'{month // 100:04d}-{month % 100:02d}' if month else None
+
+def compute_stats(db, user_id=None, start_date=None, end_date=None):
+    """Totals, per-category breakdowns and monthly buckets in a single query
+
+    Raises ValueError for a malformed start_date or end_date.
+    """
+    params = []
+    start = parse_date(start_date) if start_date else None
+    end = parse_date(end_date) if end_date else None
+    
+    # Whole-month ranges can be answered from transaction_summary; anything
+    # finer reads transactions through the covering (user_id, day, ...) index
+    if (not start or start.day == 1) and (not end or (end + timedelta(days=1)).day == 1):
+        query = '''SELECT type, category_id, month, SUM(total) as total, SUM(count) as count
+                   FROM transaction_summary WHERE 1=1'''
+        if start:
+            query += ' AND month >= ?'
+            params.append(_month_number(start))
+        if end:
+            query += ' AND month <= ?'
+            params.append(_month_number(end))
+    else:
+        query = '''SELECT type, category_id, month, SUM(amount) as total, COUNT(*) as count
+                   FROM transactions WHERE 1=1'''
+        if start:
+            query += ' AND day >= ?'
+            params.append(to_day_number(start_date))
+        if end:
+            query += ' AND day <= ?'
+            params.append(to_day_number(end_date))
+    
+    if user_id is not None:
+        query += ' AND user_id = ?'
+        params.append(user_id)
+    
+    query += ' GROUP BY 1, 2, 3'
+    
+    totals = {'income': 0, 'expense': 0}
+    by_category = {'income': {}, 'expense': {}}
+    by_month = {}
+    count = 0
+    
+    # Fold the grouped rows into each breakdown; grouping ran on integer
+    # ids, names are attached from the category cache
+    labels = category_labels(db)
+    for row in db.execute(query, params):
+        trans_type = row['type']
+        if trans_type not in totals:
+            continue
+        totals[trans_type] += row['total']
+        count += row['count']
+        categories = by_category[trans_type]
+        category = labels.get(row['category_id'])
+        categories[category] = categories.get(category, 0) + row['total']
+        bucket = (row['month'], trans_type)
+        by_month[bucket] = by_month.get(bucket, 0) + row['total']
+    
+    def category_list(trans_type):
+        items = sorted(by_category[trans_type].items(), key=lambda item: item[1], reverse=True)
+        return [{'category': category, 'total': from_minor_units(total)} for category, total in items]
+    
+    # Sums are exact integer paise up to this point
+    return {
+        'total_income': from_minor_units(totals['income']),
+        'total_expenses': from_minor_units(totals['expense']),
+        'balance': from_minor_units(totals['income'] - totals['expense']),
+        'transaction_count': count,
+        'expense_by_category': category_list('expense'),
+        'income_by_category': category_list('income'),
+        'by_month': [{'month': _month_label(month), 'type': trans_type, 'total': from_minor_units(total)}
+                     for (month, trans_type), total in sorted(by_month.items(), key=lambda item: item[0][0] or 0, reverse=True)]
+    }
+
 @bp.route('/stats', methods=['GET'])
 @login_required
-@admin_required
+@conditional_get('transactions', 'categories', admin_sees_all=True)
 def get_stats():
-    # Only admins can access stats
-    db = get_db()
-    c = db.cursor()
+    # Admins may look at everyone or a single user, users see only their own
+    try:
+        user_id = scoped_user_id()
+        stats = compute_stats(get_db(),
+                              user_id=user_id,
+                              start_date=request.args.get('start_date') or None,
+                              end_date=request.args.get('end_date') or None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(stats)
+
+CSV_EXPORT_BATCH_SIZE = 1000
+# Columns of a CSV export, shared with background exports (routes/exports.py)
+CSV_EXPORT_HEADER = ['Date', 'User', 'Type', 'Category', 'Description', 'Amount']
+CSV_EXPORT_QUERY = '''SELECT date, username, type, (SELECT name FROM categories WHERE id = category_id),
+                             description, printf('%.2f', amount / 100.0)
+                      FROM transactions WHERE 1=1'''
+
+def _generate_csv(query, params):
+    """Yield CSV text one fetchmany() batch at a time"""
+    # Runs after the view has returned; stream_with_context keeps the
+    # request context, and with it the get_db() connection, open until the
+    # last row is sent
+    cursor = get_db().cursor()
+    cursor.execute(query, params)
     
-    # Total income (all users)
-    c.execute('SELECT COALESCE(SUM(amount), 0) as total FROM transactions WHERE type = "income"')
-    total_income = c.fetchone()['total']
-    
-    # Total expenses (all users)
-    c.execute('SELECT COALESCE(SUM(amount), 0) as total FROM transactions WHERE type = "expense"')
-    total_expenses = c.fetchone()['total']
-    
-    # Category breakdown for expenses
-    c.execute('''SELECT category, COALESCE(SUM(amount), 0) as total 
-                 FROM transactions 
-                 WHERE type = "expense"
-                 GROUP BY category 
-                 ORDER BY total DESC''')
-    expense_by_category = [dict(row) for row in c.fetchall()]
-    
-    # Category breakdown for income
-    c.execute('''SELECT category, COALESCE(SUM(amount), 0) as total 
-                 FROM transactions 
-                 WHERE type = "income"
-                 GROUP BY category 
-                 ORDER BY total DESC''')
-    income_by_category = [dict(row) for row in c.fetchall()]
-    
-    # Monthly breakdown (last 6 months)
-    c.execute('''SELECT strftime('%Y-%m', date) as month, 
-                 type,
-                 COALESCE(SUM(amount), 0) as total
-                 FROM transactions
-                 WHERE date >= date('now', '-6 months')
-                 GROUP BY month, type
-                 ORDER BY month DESC''')
-    by_month = [dict(row) for row in c.fetchall()]
-    
-    return jsonify({
-        'total_income': total_income,
-        'total_expenses': total_expenses,
-        'balance': total_income - total_expenses,
-        'expense_by_category': expense_by_category,
-        'income_by_category': income_by_category,
-        'by_month': by_month
-    })
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(CSV_EXPORT_HEADER)
+    
+    while True:
+        rows = cursor.fetchmany(CSV_EXPORT_BATCH_SIZE)
+        if not rows:
+            break
+        writer.writerows(rows)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate(0)
+    
+    # Header-only export when nothing matched
+    if output.tell():
+        yield output.getvalue()
 
 @bp.route('/download-csv', methods=['GET'])
 @login_required
@@ -279,69 +681,72 @@ def get_stats():
 def download_csv():
     # Only admins can download CSV
     
-    # Get filter parameters
-    trans_type = request.args.get('type')
-    category = request.args.get('category')
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    
-    db = get_db()
-    c = db.cursor()
-    
-    query = 'SELECT date, username, type, category, description, amount FROM transactions WHERE 1=1'
+    query = CSV_EXPORT_QUERY
     params = []
+    try:
+        query += transaction_filters(request.args, params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    query += ' ORDER BY day DESC, id DESC'
     
-    if trans_type and trans_type != 'all':
-        query += ' AND type = ?'
-        params.append(trans_type)
-    
-    if category and category != 'all':
-        query += ' AND category = ?'
-        params.append(category)
-    
-    if start_date:
-        query += ' AND date >= ?'
-        params.append(start_date)
-    
-    if end_date:
-        query += ' AND date <= ?'
-        params.append(end_date)
-    
-    query += ' ORDER BY date DESC'
-    
-    c.execute(query, params)
-    transactions = c.fetchall()
-    
-    # Create CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Date', 'User', 'Type', 'Category', 'Description', 'Amount'])
-    
-    for trans in transactions:
-        writer.writerow(trans)
-    
-    # Create response
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'text/csv'
+    response = Response(stream_with_context(_generate_csv(query, params)), mimetype='text/csv')
     response.headers['Content-Disposition'] = f'attachment; filename=transactions_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+    # Ask a fronting nginx not to buffer the whole export before sending it
+    response.headers['X-Accel-Buffering'] = 'no'
     
     return response
 
-@bp.route('/attachments/<filename>')
+@bp.route('/attachments/<path:filename>')
 @login_required
 def download_attachment(filename):
     """Download or view attachment file"""
+    # Only serve files attached to one of the caller's transactions (any
+    # transaction for admins); the original name gives the content type
+    if session['role'] == 'admin':
+        trans = get_db().execute('''SELECT attachment_filename FROM transactions
+                                     WHERE attachment_path = ? LIMIT 1''', (filename,)).fetchone()
+    else:
+        trans = get_db().execute('''SELECT attachment_filename FROM transactions
+                                     WHERE attachment_path = ? AND user_id = ? LIMIT 1''',
+                                 (filename, session['user_id'])).fetchone()
+    
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    if not trans or not os.path.isfile(file_path):
+        return jsonify({'error': 'File not found'}), 404
+    
     try:
-        # Verify file exists
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-        if not os.path.exists(file_path):
-            return jsonify({'error': 'File not found'}), 404
-        
-        return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+        return attachments.send_attachment(filename, trans['attachment_filename'])
     except Exception as e:
         print(f"Error serving file: {e}")
         return jsonify({'error': 'File not found'}), 404
 
+@bp.route('/attachments/<int:transaction_id>/thumb')
+@login_required
+def attachment_thumbnail(transaction_id):
+    """Small JPEG preview of a transaction's image or PDF attachment"""
+    if session['role'] == 'admin':
+        trans = get_db().execute('SELECT attachment_path FROM transactions WHERE id = ?',
+                                 (transaction_id,)).fetchone()
+    else:
+        trans = get_db().execute('SELECT attachment_path FROM transactions WHERE id = ? AND user_id = ?',
+                                 (transaction_id, session['user_id'])).fetchone()
+    if not trans or not trans['attachment_path']:
+        return jsonify({'error': 'Attachment not found'}), 404
+    
+    store_path = trans['attachment_path']
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], store_path)
+    if not os.path.exists(previews.preview_path(file_path)):
+        if not os.path.isfile(file_path) or previews.preview_kind(file_path) is None:
+            return jsonify({'error': 'No preview available'}), 404
+        # Not rendered yet (still queued, or uploaded before previews existed)
+        previews.schedule(store_path)
+        response = jsonify({'status': 'pending'})
+        response.status_code = 202
+        response.headers['Retry-After'] = '2'
+        return response
+    
+    return attachments.send_attachment(store_path + attachments.PREVIEW_SUFFIX, 'preview.jpg')
+
 # Delete attachment route
 @bp.route('/transactions/<int:transaction_id>/attachment', methods=['DELETE'])
 @login_required
@@ -365,22 +770,15 @@ def delete_attachment(transaction_id):
         return jsonify({'error': 'Transaction not found'}), 404
     
     if trans['attachment_path']:
-        # Delete file from filesystem
-        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], trans['attachment_path'])
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-            except Exception as e:
-                print(f"Error deleting file: {e}")
-        
         # Update database
         if role == 'admin':
-            c.execute('UPDATE transactions SET attachment_filename = NULL, attachment_path = NULL WHERE id = ?', 
-                      (transaction_id,))
+            run_write(lambda conn: conn.execute('UPDATE transactions SET attachment_filename = NULL, attachment_path = NULL, attachment_size = NULL WHERE id = ?', 
+                                                (transaction_id,)))
         else:
-            c.execute('UPDATE transactions SET attachment_filename = NULL, attachment_path = NULL WHERE id = ? AND user_id = ?', 
-                      (transaction_id, user_id))
+            run_write(lambda conn: conn.execute('UPDATE transactions SET attachment_filename = NULL, attachment_path = NULL, attachment_size = NULL WHERE id = ? AND user_id = ?', 
+                                                (transaction_id, user_id)))
         
-        db.commit()
+        # Delete file from filesystem unless another transaction shares it
+        attachments.release([trans['attachment_path']])
     
     return jsonify({'message': 'Attachment deleted successfully'})
@@ -2,19 +2,15 @@ let editingTransactionId = null;
 let currentType = 'expense';
 let currentAttachmentPath = null;
 
-// Hide stats and download button for regular users
+// Hide download button for regular users; stats are scoped to the caller
 if (typeof USER_ROLE !== 'undefined') {
+    const stats = document.getElementById('dashboardStats');
+    if (stats) stats.classList.add('hidden');
+    const catStats = document.getElementById('categoryStats');
+    if (catStats) catStats.style.display = 'block';
     if (USER_ROLE === 'user') {
-        const stats = document.getElementById('dashboardStats');
-        if (stats) stats.classList.add('hidden');
         const dlBtn = document.getElementById('downloadBtn');
         if (dlBtn) dlBtn.classList.add('hidden');
-    } else {
-        // Show category stats for admins
-        const stats = document.getElementById('dashboardStats');
-        if (stats) stats.classList.add('hidden');
-        const catStats = document.getElementById('categoryStats');
-        if (catStats) catStats.style.display = 'block';
     }
 }
 
@@ -102,10 +98,7 @@ if (transactionForm) {
 
                 if (typeof updateCategoryOptions === 'function') updateCategoryOptions();
                 await loadTransactions();
-                if (typeof USER_ROLE !== 'undefined' && USER_ROLE === 'admin') {
-                    await loadStats();
-                    await loadCategoryStats();
-                }
+                await loadStats();
             } else {
                 const errorData = await response.json();
                 alert('Error: ' + (errorData.error || 'Failed to save transaction'));
@@ -125,35 +118,123 @@ const filterCategory = document.getElementById('filterCategory');
 if (filterCategory) filterCategory.addEventListener('change', loadTransactions);
 
 const startDate = document.getElementById('startDate');
-if (startDate) startDate.addEventListener('change', loadTransactions);
+if (startDate) {
+    startDate.addEventListener('change', loadTransactions);
+    startDate.addEventListener('change', loadStats);
+}
 
 const endDate = document.getElementById('endDate');
-if (endDate) endDate.addEventListener('change', loadTransactions);
+if (endDate) {
+    endDate.addEventListener('change', loadTransactions);
+    endDate.addEventListener('change', loadStats);
+}
 
-async function loadTransactions() {
+let transactionsCursor = null;
+let transactionsLoading = false;
+let transactionsRequestId = 0;
+
+function buildTransactionFilterQuery() {
     const type = document.getElementById('filterType').value;
     const category = document.getElementById('filterCategory').value;
     const startDate = document.getElementById('startDate').value;
     const endDate = document.getElementById('endDate').value;
 
-    let url = '/api/transactions?';
-    if (type !== 'all') url += `type=${type}&`;
-    if (category !== 'all') url += `category=${category}&`;
-    if (startDate) url += `start_date=${startDate}&`;
-    if (endDate) url += `end_date=${endDate}`;
+    const params = new URLSearchParams();
+    if (type !== 'all') params.set('type', type);
+    if (category !== 'all') params.set('category', category);
+    if (startDate) params.set('start_date', startDate);
+    if (endDate) params.set('end_date', endDate);
+    return params;
+}
+
+async function fetchTransactionPage(cursor) {
+    const params = buildTransactionFilterQuery();
+    if (cursor) params.set('cursor', cursor);
+
+    const response = await fetch(`/api/transactions?${params.toString()}`);
+    return response.json();
+}
+
+// Loads the first page for the current filters and resets infinite scroll
+async function loadTransactions() {
+    const transactionList = document.getElementById('transactionList');
+    if (!transactionList) return;
+
+    const requestId = ++transactionsRequestId;
+    transactionsLoading = true;
+    try {
+        const page = await fetchTransactionPage(null);
+        // A newer filter change superseded this request
+        if (requestId !== transactionsRequestId) return;
+
+        transactionsCursor = page.next_cursor;
+
+        if (page.transactions.length === 0) {
+            transactionList.innerHTML = '<div class="empty-state"><p>No transactions found</p></div>';
+            return;
+        }
+
+        transactionList.innerHTML = renderTransactions(page.transactions);
+    } finally {
+        if (requestId === transactionsRequestId) transactionsLoading = false;
+    }
+}
 
-    const response = await fetch(url);
-    const transactions = await response.json();
+// Appends the next page when the user scrolls near the end of the list
+async function loadMoreTransactions() {
+    if (transactionsLoading || !transactionsCursor) return;
 
     const transactionList = document.getElementById('transactionList');
     if (!transactionList) return;
 
-    if (transactions.length === 0) {
-        transactionList.innerHTML = '<div class="empty-state"><p>No transactions found</p></div>';
+    const requestId = transactionsRequestId;
+    transactionsLoading = true;
+    try {
+        const page = await fetchTransactionPage(transactionsCursor);
+        if (requestId !== transactionsRequestId) return;
+
+        transactionsCursor = page.next_cursor;
+        transactionList.insertAdjacentHTML('beforeend', renderTransactions(page.transactions));
+    } catch (error) {
+        console.error('Error loading more transactions:', error);
+    } finally {
+        if (requestId === transactionsRequestId) transactionsLoading = false;
+    }
+}
+
+const transactionListSentinel = document.getElementById('transactionListSentinel');
+if (transactionListSentinel && 'IntersectionObserver' in window) {
+    new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) loadMoreTransactions();
+    }, { rootMargin: '200px' }).observe(transactionListSentinel);
+}
+
+const PREVIEWABLE_ATTACHMENT = /\.(jpe?g|png|gif|bmp|pdf)$/i;
+const THUMBNAIL_RETRIES = 5;
+
+// A preview still being rendered answers 202, which the <img> sees as an
+// error: show a placeholder and ask again shortly. Anything else means
+// there is no preview, so the thumbnail goes.
+async function retryThumbnail(img) {
+    const attempt = Number(img.dataset.attempt || 0) + 1;
+    const url = `/api/attachments/${img.dataset.id}/thumb`;
+    let status = 0;
+    try {
+        status = (await fetch(url)).status;
+    } catch (error) {
+        status = 0;
+    }
+    if (attempt > THUMBNAIL_RETRIES || (status !== 200 && status !== 202)) {
+        img.remove();
         return;
     }
+    img.dataset.attempt = attempt;
+    img.classList.add('pending');
+    setTimeout(() => { img.src = `${url}?attempt=${attempt}`; }, status === 202 ? 2000 * attempt : 0);
+}
 
-    transactionList.innerHTML = transactions.map(trans => {
+function renderTransactions(transactions) {
+    return transactions.map(trans => {
         const escapedDescription = (trans.description || 'No description').replace(/'/g, '&#39;').replace(/"/g, '&quot;');
         const transData = {
             id: trans.id,
@@ -171,8 +252,13 @@ async function loadTransactions() {
         const attachmentBadge = trans.attachment_filename ?
             `<span class="attachment-badge" onclick="viewAttachment('${trans.attachment_path}', '${trans.attachment_filename}')" title="View attachment">📎 ${trans.attachment_filename}</span>` : '';
 
+        // Small server-rendered preview instead of the full-size original
+        const attachmentThumb = trans.attachment_filename && PREVIEWABLE_ATTACHMENT.test(trans.attachment_filename) ?
+            `<img class="attachment-thumb" src="/api/attachments/${trans.id}/thumb" alt="" loading="lazy" onclick="viewAttachment('${trans.attachment_path}', '${trans.attachment_filename}')" data-id="${trans.id}" onload="this.classList.remove('pending')" onerror="retryThumbnail(this)">` : '';
+
         return `
         <div class="transaction-item ${trans.type}">
+            ${attachmentThumb}
             <div class="transaction-info">
                 <h4>
                     <span class="type-badge ${trans.type}">${trans.type}</span>
@@ -197,9 +283,16 @@ async function loadTransactions() {
     }).join('');
 }
 
+// Stats follow the date range filter; one request feeds every stats view
 async function loadStats() {
     try {
-        const response = await fetch('/api/stats');
+        const params = new URLSearchParams();
+        const startDate = document.getElementById('startDate').value;
+        const endDate = document.getElementById('endDate').value;
+        if (startDate) params.set('start_date', startDate);
+        if (endDate) params.set('end_date', endDate);
+
+        const response = await fetch(`/api/stats?${params.toString()}`);
         if (!response.ok) return;
 
         const stats = await response.json();
@@ -207,10 +300,16 @@ async function loadStats() {
         document.getElementById('totalIncome').textContent = `₹${stats.total_income.toFixed(2)}`;
         document.getElementById('totalExpenses').textContent = `₹${stats.total_expenses.toFixed(2)}`;
         document.getElementById('balance').textContent = `₹${stats.balance.toFixed(2)}`;
+        document.getElementById('totalItems').textContent = stats.transaction_count;
+
+        // Display expense category stats
+        displayCategoryStats(stats.expense_by_category, 'expense', stats.total_expenses);
+
+        // Display income category stats
+        displayCategoryStats(stats.income_by_category, 'income', stats.total_income);
 
-        const allTransactions = await fetch('/api/transactions');
-        const transactions = await allTransactions.json();
-        document.getElementById('totalItems').textContent = transactions.length;
+        // Display comparison
+        displayComparison(stats.expense_by_category, stats.income_by_category, stats.total_expenses, stats.total_income);
     } catch (error) {
         console.error('Error loading stats:', error);
     }
@@ -282,10 +381,7 @@ async function deleteTransaction(id) {
             const response = await fetch(`/api/transactions/${id}`, { method: 'DELETE' });
             if (response.ok) {
                 loadTransactions();
-                if (typeof USER_ROLE !== 'undefined' && USER_ROLE === 'admin') {
-                    loadStats();
-                    loadCategoryStats();
-                }
+                loadStats();
             } else {
                 alert('Error deleting transaction');
             }
@@ -301,13 +397,39 @@ async function downloadCSV() {
     const startDate = document.getElementById('startDate').value;
     const endDate = document.getElementById('endDate').value;
 
-    let url = '/api/download-csv?';
-    if (type !== 'all') url += `type=${type}&`;
-    if (category !== 'all') url += `category=${category}&`;
-    if (startDate) url += `start_date=${startDate}&`;
-    if (endDate) url += `end_date=${endDate}`;
+    const filters = { format: 'csv' };
+    if (type !== 'all') filters.type = type;
+    if (category !== 'all') filters.category = category;
+    if (startDate) filters.start_date = startDate;
+    if (endDate) filters.end_date = endDate;
 
-    window.location.href = url;
+    // The file is built in the background; poll until it is ready
+    const button = document.getElementById('downloadBtn');
+    const label = button.textContent;
+    button.disabled = true;
+    try {
+        const response = await fetch('/api/exports', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(filters)
+        });
+        let exportJob = await response.json();
+        if (!response.ok) throw new Error(exportJob.error);
+
+        const statusUrl = response.headers.get('Location');
+        while (exportJob.status !== 'done') {
+            if (exportJob.status === 'failed') throw new Error(exportJob.error);
+            button.textContent = `⏳ Preparing ${exportJob.progress}%`;
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            exportJob = await (await fetch(statusUrl)).json();
+        }
+        window.location.href = exportJob.download_url;
+    } catch (error) {
+        alert('Error preparing export' + (error.message ? `: ${error.message}` : ''));
+    } finally {
+        button.textContent = label;
+        button.disabled = false;
+    }
 }
 
 function switchStatsTab(tab) {
@@ -320,27 +442,6 @@ function switchStatsTab(tab) {
     document.getElementById(tab + 'StatsContent').classList.add('active');
 }
 
-async function loadCategoryStats() {
-    try {
-        const response = await fetch('/api/stats');
-        if (!response.ok) return;
-
-        const stats = await response.json();
-
-        // Display expense category stats
-        displayCategoryStats(stats.expense_by_category, 'expense', stats.total_expenses);
-
-        // Display income category stats
-        displayCategoryStats(stats.income_by_category, 'income', stats.total_income);
-
-        // Display comparison
-        displayComparison(stats.expense_by_category, stats.income_by_category, stats.total_expenses, stats.total_income);
-
-    } catch (error) {
-        console.error('Error loading category stats:', error);
-    }
-}
-
 function displayCategoryStats(categories, type, total) {
     const gridId = type === 'expense' ? 'expenseStatsGrid' : 'incomeStatsGrid';
     const grid = document.getElementById(gridId);
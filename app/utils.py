@@ -1,22 +1,74 @@
-import os
+import hashlib
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from functools import wraps
-from flask import session, redirect, url_for, jsonify, current_app
-from werkzeug.utils import secure_filename
+from flask import session, redirect, url_for, jsonify, current_app, request, make_response
+from app.db import get_db, get_data_versions
 
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif', 'bmp', 'doc', 'docx', 'xls', 'xlsx', 'txt'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def secure_filename_custom(filename):
-    """Create a secure filename with timestamp"""
-    # First use werkzeug's secure_filename
-    filename = secure_filename(filename)
-    # Then add timestamp
-    name, ext = os.path.splitext(filename)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    return f"{timestamp}_{name}{ext}"
+# Largest amount accepted, in paise (100 billion rupees). Well inside
+# SQLite's 64-bit integers even summed over many rows, and below 2**53 so
+# the amount survives as a JSON number.
+MAX_MINOR_UNITS = 10 ** 13
+
+def to_minor_units(value):
+    """Parse a money amount into integer paise, rejecting anything inexact"""
+    if value is None or isinstance(value, bool) or str(value).strip() == '':
+        raise ValueError('Missing amount')
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount: {value}')
+    if not amount.is_finite():
+        raise ValueError(f'Invalid amount: {value}')
+
+    minor = amount * 100
+    if minor != minor.to_integral_value():
+        raise ValueError('Amount cannot have more than 2 decimal places')
+    if abs(minor) > MAX_MINOR_UNITS:
+        raise ValueError(f'Amount cannot exceed {from_minor_units(MAX_MINOR_UNITS):,.0f}')
+    return int(minor)
+
+def from_minor_units(value):
+    """Integer paise to the decimal amount the API exposes"""
+    return value / 100
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD date, raising ValueError for anything else"""
+    try:
+        return datetime.strptime(str(value or '').strip(), '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'Invalid date: {value}')
+
+def to_day_number(value):
+    """Days since 1970-01-01, matching the transactions.day column"""
+    return (parse_date(value) - datetime(1970, 1, 1)).days
+
+def date_columns(value):
+    """Normalized (date, day, month) values to store for a transaction date"""
+    parsed = parse_date(value)
+    return parsed.strftime('%Y-%m-%d'), to_day_number(value), parsed.year * 100 + parsed.month
+
+def scoped_user_id():
+    """User whose data an aggregate view covers: the caller's own, or for
+    admins the ?user_id= one (None = every user)
+
+    Raises ValueError for a user_id that is not a whole number, rather than
+    quietly widening the view to everyone.
+    """
+    if session.get('role') != 'admin':
+        return session['user_id']
+    raw = request.args.get('user_id')
+    if not raw:
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        raise ValueError(f'Invalid user_id: {raw}')
 
 # Login required decorator
 def login_required(f):
@@ -37,3 +89,34 @@ def admin_required(f):
             return jsonify({'error': 'Admin access required'}), 403
         return f(*args, **kwargs)
     return decorated_function
+
+# Conditional GET decorator
+def conditional_get(*tables, shared=False, admin_sees_all=False):
+    """Answer If-None-Match with 304 while none of the given tables changed"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # Views over every user's rows depend on the all-users counter
+            if shared or (admin_sees_all and session.get('role') == 'admin'):
+                scope = 0
+            else:
+                scope = session['user_id']
+
+            # The ETag comes from the data_versions counters, so an unchanged
+            # poll costs one small lookup instead of running the view
+            versions = get_data_versions(get_db(), tables, scope)
+            key = f"{session.get('user_id')}:{session.get('role')}:{request.full_path}:{versions}"
+            etag = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
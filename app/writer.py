@@ -0,0 +1,171 @@
+import time
+import queue
+import random
+import sqlite3
+import threading
+from concurrent.futures import Future
+from flask import current_app
+from app.db import apply_storage_profile, get_db
+from app.process_local import ProcessLocal
+
+class GroupCommitWriter:
+    """Single writer thread per worker process that commits writes in groups"""
+
+    # Route code hands over a function taking a connection. The writer
+    # waits briefly for more work, runs the whole group inside one
+    # transaction (each function under its own savepoint so a failure only
+    # undoes that request), commits once and hands each caller its result.
+
+    def __init__(self, database, profile='durable', max_batch=64, max_wait=0.002,
+                 busy_retries=8, busy_backoff=0.01):
+        self.database = database
+        self.profile = profile
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.busy_retries = busy_retries
+        self.busy_backoff = busy_backoff
+        # The queue and thread of the writer serving this process
+        self._writer = ProcessLocal(self._start)
+
+    def _new_writer(self):
+        work = queue.Queue()
+        return work, threading.Thread(target=self._run, args=(work,), name='sqlite-writer', daemon=True)
+
+    def _start(self):
+        writer = self._new_writer()
+        writer[1].start()
+        return writer
+
+    def _live_queue(self):
+        writer = self._writer.get()
+        if not writer[1].is_alive():
+            # It died on something it could not hand back to a caller (its
+            # connection failed to open, say); start another one
+            fresh = self._new_writer()
+            writer = self._writer.replace(writer, fresh)
+            if writer is fresh:
+                fresh[1].start()
+        return writer[0]
+
+    def submit(self, fn, timeout=30):
+        """Run fn(conn) in the next group commit and return its result
+
+        Raises TimeoutError if the writer has not started fn within timeout
+        seconds; fn is then dropped, so nothing of it is written. Once fn
+        has started, its outcome is waited for however long it takes.
+        """
+        future = Future()
+        self._live_queue().put((fn, future))
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            # Still queued: take it back. Otherwise it is already part of
+            # a group, and reporting failure for a write that then commits
+            # would only lead the client to send it again.
+            if future.cancel():
+                raise
+        return future.result()
+
+    def _connect(self):
+        # Autocommit mode: the writer issues BEGIN/COMMIT itself
+        conn = sqlite3.connect(self.database, isolation_level=None,
+                               detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.row_factory = sqlite3.Row
+        apply_storage_profile(conn, self.profile)
+        return conn
+
+    def _with_busy_retry(self, statement, conn):
+        for attempt in range(self.busy_retries + 1):
+            try:
+                return conn.execute(statement)
+            except sqlite3.OperationalError as e:
+                message = str(e)
+                if attempt == self.busy_retries or ('locked' not in message and 'busy' not in message):
+                    raise
+                # Another worker holds the write lock; back off with jitter
+                time.sleep(self.busy_backoff * (2 ** attempt) * (0.5 + random.random()))
+
+    def _collect(self, work):
+        batch = [work.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(work.get(timeout=remaining) if remaining > 0 else work.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, work):
+        conn = self._connect()
+        while True:
+            # Skip work whose caller gave up waiting; the rest can no longer
+            # be cancelled
+            batch = [(fn, future) for fn, future in self._collect(work)
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            results = []
+            try:
+                self._with_busy_retry('BEGIN IMMEDIATE', conn)
+                for fn, future in batch:
+                    conn.execute('SAVEPOINT request')
+                    try:
+                        result = fn(conn)
+                    # Anything fn raises, SystemExit included, belongs to its
+                    # caller; letting it through would kill this thread and
+                    # leave every later write in the process queued forever
+                    except BaseException as e:
+                        conn.execute('ROLLBACK TO request')
+                        conn.execute('RELEASE request')
+                        results.append((future, None, e))
+                        continue
+                    conn.execute('RELEASE request')
+                    results.append((future, result, None))
+                self._with_busy_retry('COMMIT', conn)
+            except BaseException as e:
+                # The group as a whole failed; nothing from it was committed
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                for fn, future in batch:
+                    future.set_exception(e)
+                if isinstance(e, sqlite3.DatabaseError):
+                    conn.close()
+                    conn = self._connect()
+                continue
+
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+def run_write(fn):
+    """Run fn(conn) through the app's write path and return its result
+
+    fn runs inside the writer's transaction and every other write in the
+    process waits while it does, so keep it short: parse, validate and read
+    beforehand and hand over only the statements to execute.
+    """
+    writer = current_app.extensions.get('sqlite_writer')
+    if writer is not None:
+        return writer.submit(fn)
+
+    # Group commit disabled: write and commit on the request connection
+    db = get_db()
+    try:
+        result = fn(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return result
+
+def init_app(app):
+    if app.config.get('GROUP_COMMIT', True):
+        app.extensions['sqlite_writer'] = GroupCommitWriter(
+            app.config['DATABASE'],
+            profile=app.config.get('DB_PROFILE', 'durable'),
+            max_batch=app.config.get('WRITE_BATCH_SIZE', 64),
+            max_wait=app.config.get('WRITE_BATCH_WAIT_MS', 2) / 1000
+        )
@@ -0,0 +1,100 @@
+"""Compare SQLite storage profiles: write throughput and fsync counts.
+
+Run from the project root, ideally on the target device and disk:
+
+    python benchmarks/db_profiles.py --dir /home/pi/finance-tracker/instance
+
+Each profile runs in its own process. When strace is installed, that
+process runs under it to count fsync/fdatasync calls.
+"""
+import os
+import re
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db import STORAGE_PROFILES, apply_storage_profile
+
+def run_workload(profile, directory, commits):
+    """Insert one transaction per commit, like a burst of API writes"""
+    path = os.path.join(directory, f'bench_{profile}.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    conn = sqlite3.connect(path)
+    apply_storage_profile(conn, profile)
+    conn.execute('''CREATE TABLE transactions
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id INTEGER NOT NULL,
+                     amount INTEGER NOT NULL,
+                     type TEXT NOT NULL,
+                     category TEXT NOT NULL,
+                     date TEXT NOT NULL)''')
+    conn.execute('CREATE INDEX idx_user_date ON transactions (user_id, date DESC, id DESC)')
+    conn.commit()
+
+    start = time.perf_counter()
+    for i in range(commits):
+        conn.execute('INSERT INTO transactions (user_id, amount, type, category, date) VALUES (?, ?, ?, ?, ?)',
+                     (i % 4, i * 150, 'expense', 'Food', f'2024-{i % 12 + 1:02d}-01'))
+        conn.commit()
+    elapsed = time.perf_counter() - start
+    conn.close()
+
+    print(f'RESULT {commits / elapsed:.1f}')
+
+def count_fsyncs(strace_output):
+    total = 0
+    for line in strace_output.splitlines():
+        match = re.match(r'\s*[\d.]+\s+[\d.]+\s+\d+\s+(\d+)\s+(?:\d+\s+)?(fsync|fdatasync)\s*$', line)
+        if match:
+            total += int(match.group(1))
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', help='directory on the disk to test (default: a temp dir)')
+    parser.add_argument('--commits', type=int, default=500)
+    parser.add_argument('--profile', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix='db_profiles_')
+
+    # Child process: run a single profile
+    if args.profile:
+        run_workload(args.profile, directory, args.commits)
+        return
+
+    strace = shutil.which('strace')
+    if not strace:
+        print('strace not found; fsync counts will be unavailable.\n')
+
+    print(f'{"profile":<10} {"commits/s":>10} {"fsyncs":>8}')
+    for profile in STORAGE_PROFILES:
+        command = [sys.executable, os.path.abspath(__file__), '--profile', profile,
+                   '--dir', directory, '--commits', str(args.commits)]
+        fsyncs = 'n/a'
+        if strace:
+            trace_file = os.path.join(directory, f'strace_{profile}.txt')
+            command = [strace, '-f', '-c', '-e', 'trace=fsync,fdatasync', '-o', trace_file] + command
+
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        throughput = re.search(r'RESULT ([\d.]+)', output).group(1)
+        if strace:
+            with open(trace_file) as f:
+                fsyncs = count_fsyncs(f.read())
+
+        print(f'{profile:<10} {throughput:>10} {fsyncs:>8}')
+
+    if not args.dir:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
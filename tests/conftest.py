@@ -0,0 +1,76 @@
+import pytest
+from concurrent.futures import Future
+from app import create_app
+from app.db import init_db
+from app.jobs import JobRunner
+from app.writer import run_write
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Build an app on a database in tmp_path; extra config overrides the defaults"""
+    def _make_app(**config):
+        app = create_app({
+            'TESTING': True,
+            'DATABASE': str(tmp_path / 'expenses.db'),
+            'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+            'EXPORT_FOLDER': str(tmp_path / 'exports'),
+            'ATTACHMENT_PREVIEWS': False,
+            # Tests drive job runners themselves
+            'JOB_WORKER_THREADS': 0,
+            **config,
+        })
+        return app
+    return _make_app
+
+@pytest.fixture
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        init_db()
+    return app
+
+def login(client, user_id, username, role='user'):
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['username'] = username
+        session['role'] = role
+
+@pytest.fixture
+def client_for(app):
+    """Test client signed in as a new user; client.user_id is its id"""
+    def _client_for(username, role='user'):
+        with app.app_context():
+            user_id = run_write(lambda conn: conn.execute(
+                "INSERT INTO users (username, password, role) VALUES (?, 'x', ?)", (username, role)).lastrowid)
+        client = app.test_client()
+        login(client, user_id, username, role)
+        client.user_id = user_id
+        return client
+    return _client_for
+
+def add_transaction(client, amount='10.00', type='expense', category='🍔 Food & Dining', date='2024-03-05', **fields):
+    response = client.post('/api/transactions', json=dict(amount=amount, type=type, category=category,
+                                                          date=date, **fields))
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['id']
+
+class _InlineExecutor:
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+def run_jobs(app):
+    """Run queued jobs on this thread until none are due"""
+    runner = JobRunner(app)
+    runner.worker_id = 'tests'
+    with app.app_context():
+        while True:
+            claimed = runner._claim(10)
+            if not claimed:
+                return
+            for job_id, name, payload in claimed:
+                runner._submit(_InlineExecutor(), job_id, name, payload)
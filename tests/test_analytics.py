@@ -0,0 +1,50 @@
+import pytest
+from tests.conftest import add_transaction
+
+def _analytics(client, **params):
+    response = client.get('/api/analytics', query_string={'as_of': '2024-03-10', **params})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+@pytest.fixture
+def alice(client_for):
+    alice = client_for('alice')
+    add_transaction(alice, amount='10.00', date='2024-03-08')
+    add_transaction(alice, amount='20.00', date='2024-03-10')
+    add_transaction(alice, amount='1000', type='income', category='💼 Salary', date='2024-03-01')
+    return alice
+
+def test_rolling_spend(alice):
+    rolling = _analytics(alice, days=3, window=2)['rolling_spend']
+    assert rolling['dates'] == ['2024-03-08', '2024-03-09', '2024-03-10']
+    assert rolling['daily'] == [10.0, 0.0, 20.0]
+    assert rolling['average'] == [5.0, 5.0, 10.0]
+
+def test_month_end_forecast(alice):
+    forecast = _analytics(alice)['forecast']
+    assert (forecast['month'], forecast['days_elapsed'], forecast['days_in_month']) == ('2024-03', 10, 31)
+    assert forecast['daily_expense_rate'] == 3.0
+    assert forecast['projected_expense'] == 93.0
+    assert forecast['projected_income'] == 1000.0
+    assert forecast['balance'] == 970.0
+    assert forecast['projected_balance'] == 907.0
+
+def test_analytics_are_scoped_to_the_caller(alice, client_for):
+    bob = client_for('bob')
+    add_transaction(bob, amount='500.00', date='2024-03-09')
+    assert _analytics(bob, user_id=alice.user_id)['forecast']['balance'] == -500.0
+
+    admin = client_for('admin', 'admin')
+    assert _analytics(admin)['forecast']['balance'] == 470.0
+    assert _analytics(admin, user_id=alice.user_id)['forecast']['balance'] == 970.0
+
+@pytest.mark.parametrize('params, error', [
+    ({'days': 'abc'}, 'days must be a whole number from 1 to 3660'),
+    ({'window': '0'}, 'window must be a whole number from 1 to 365'),
+    ({'user_id': 'abc'}, 'Invalid user_id: abc'),
+])
+def test_bad_parameters_are_rejected(client_for, params, error):
+    admin = client_for('admin', 'admin')
+    response = admin.get('/api/analytics', query_string=params)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
@@ -0,0 +1,175 @@
+import io
+import os
+import time
+import hashlib
+import pytest
+from app.db import get_db
+from app.jobs import JobRunner
+from tests.conftest import run_jobs
+
+RECEIPT = b'%PDF-1.4 receipt for lunch'
+
+def _upload(client, content=RECEIPT, filename='receipt.pdf', **fields):
+    form = {'amount': '10.00', 'type': 'expense', 'category': '🍔 Food & Dining', 'date': '2024-03-05', **fields}
+    return client.post('/api/transactions', content_type='multipart/form-data',
+                       data={**form, 'attachment': (io.BytesIO(content), filename)})
+
+def _attachment(client, transaction_id):
+    for transaction in client.get('/api/transactions').get_json()['transactions']:
+        if transaction['id'] == transaction_id:
+            return transaction['attachment_path'], transaction['attachment_filename']
+
+def _refcount(app, path):
+    with app.app_context():
+        row = get_db().execute('SELECT refcount FROM attachment_refs WHERE path = ?', (path,)).fetchone()
+        return row and row[0]
+
+def test_upload_is_stored_under_its_hash(app, client_for):
+    alice = client_for('alice')
+    response = _upload(alice)
+    assert response.status_code == 201
+    path, name = _attachment(alice, response.get_json()['id'])
+
+    digest = hashlib.sha256(RECEIPT).hexdigest()
+    assert path == os.path.join(digest[:2], digest[2:4], digest)
+    assert name == 'receipt.pdf'
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], path), 'rb') as f:
+        assert f.read() == RECEIPT
+    # Nothing left behind in the staging directory
+    assert os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], 'tmp')) == []
+
+def test_identical_uploads_share_one_file(app, client_for):
+    alice, bob = client_for('alice'), client_for('bob')
+    first = _upload(alice).get_json()['id']
+    second = _upload(bob, filename='copy.pdf').get_json()['id']
+    path = _attachment(alice, first)[0]
+    assert _attachment(bob, second) == (path, 'copy.pdf')
+    assert _refcount(app, path) == 2
+
+    # The file outlives the first reference and goes with the last
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], path)
+    assert alice.delete(f'/api/transactions/{first}').status_code == 200
+    run_jobs(app)
+    assert os.path.exists(file_path)
+    assert _refcount(app, path) == 1
+
+    assert bob.delete(f'/api/transactions/{second}/attachment').status_code == 200
+    run_jobs(app)
+    assert not os.path.exists(file_path)
+    assert _refcount(app, path) is None
+
+def test_replacing_an_attachment_releases_the_old_file(app, client_for):
+    alice = client_for('alice')
+    transaction_id = _upload(alice).get_json()['id']
+    old_path = _attachment(alice, transaction_id)[0]
+
+    response = alice.put(f'/api/transactions/{transaction_id}', content_type='multipart/form-data',
+                         data={'amount': '10.00', 'type': 'expense', 'category': '🍔 Food & Dining',
+                               'date': '2024-03-05', 'attachment': (io.BytesIO(b'new notes'), 'notes.txt')})
+    assert response.status_code == 200
+    run_jobs(app)
+    assert _attachment(alice, transaction_id)[1] == 'notes.txt'
+    assert not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], old_path))
+
+def test_uploads_stop_at_the_quota(app, client_for):
+    app.config['ATTACHMENT_QUOTA'] = 40
+    alice = client_for('alice')
+    first = _upload(alice).get_json()['id']
+
+    response = _upload(alice, b'%PDF-1.4 a different receipt')
+    assert response.status_code == 413
+    assert response.get_json() == {'error': 'Attachment exceeds the upload size limit'}
+    assert os.listdir(os.path.join(app.config['UPLOAD_FOLDER'], 'tmp')) == []
+
+    # Removing an attachment frees its share of the quota
+    alice.delete(f'/api/transactions/{first}/attachment')
+    assert _upload(alice, b'%PDF-1.4 a different receipt').status_code == 201
+
+def test_quota_check_reads_only_the_usage_index(app):
+    with app.app_context():
+        plan = get_db().execute('''EXPLAIN QUERY PLAN SELECT COALESCE(SUM(attachment_size), 0) FROM transactions
+                                   WHERE user_id = ? AND attachment_size IS NOT NULL''', (1,)).fetchall()
+    assert 'COVERING INDEX idx_transactions_attachment_usage' in plan[0][3]
+
+def test_uploads_stop_at_the_size_limit(app, client_for):
+    app.config['ATTACHMENT_MAX_SIZE'] = 10
+    assert _upload(client_for('alice')).status_code == 413
+
+@pytest.mark.parametrize('content, filename', [
+    (b'', 'empty.txt'),
+    (b'BMW service invoice\n', 'invoice.txt'),
+    (b'BM' + b'\x00' * 12 + (40).to_bytes(4, 'little') + b'\x00' * 40, 'scan.bmp'),
+    (RECEIPT, 'receipt.pdf'),
+])
+def test_content_matching_its_extension_is_accepted(client_for, content, filename):
+    assert _upload(client_for('alice'), content, filename).status_code == 201
+
+@pytest.mark.parametrize('content, filename', [
+    (b'BMW service invoice\n', 'invoice.bmp'),
+    (RECEIPT, 'receipt.txt'),
+    (b'\x00\x01binary', 'notes.txt'),
+])
+def test_content_not_matching_its_extension_is_rejected(client_for, content, filename):
+    response = _upload(client_for('alice'), content, filename)
+    assert response.status_code == 400
+    assert 'does not match' in response.get_json()['error']
+
+def test_downloads_are_limited_to_the_owner_and_admins(client_for):
+    alice, bob, admin = client_for('alice'), client_for('bob'), client_for('admin', 'admin')
+    path = _attachment(alice, _upload(alice).get_json()['id'])[0]
+    url = '/api/attachments/' + path.replace(os.sep, '/')
+
+    assert alice.get(url).data == RECEIPT
+    assert admin.get(url).data == RECEIPT
+    assert bob.get(url).status_code == 404
+    # The same content uploaded by bob makes it his to download too
+    _upload(bob)
+    assert bob.get(url).data == RECEIPT
+
+def test_downloads_are_cacheable_and_ranged(client_for):
+    alice = client_for('alice')
+    path = _attachment(alice, _upload(alice).get_json()['id'])[0]
+    url = '/api/attachments/' + path.replace(os.sep, '/')
+
+    response = alice.get(url)
+    assert response.headers['ETag'] == f'"{os.path.basename(path)}"'
+    assert response.headers['Cache-Control'] == 'private, max-age=31536000, immutable'
+    assert response.mimetype == 'application/pdf'
+
+    cached = alice.get(url, headers={'If-None-Match': response.headers['ETag']})
+    assert (cached.status_code, cached.data) == (304, b'')
+
+    partial = alice.get(url, headers={'Range': 'bytes=0-4'})
+    assert (partial.status_code, partial.data) == (206, b'%PDF-')
+
+def test_downloads_can_be_offloaded_to_the_proxy(app, client_for):
+    app.config['ATTACHMENT_SENDFILE'] = 'x-accel'
+    alice = client_for('alice')
+    path = _attachment(alice, _upload(alice, filename='reçu.pdf').get_json()['id'])[0]
+
+    response = alice.get('/api/attachments/' + path.replace(os.sep, '/'))
+    assert response.headers['X-Accel-Redirect'] == '/protected-uploads/' + path.replace(os.sep, '/')
+    assert response.data == b''
+    assert "filename*=UTF-8''re%C3%A7u.pdf" in response.headers['Content-Disposition']
+
+def test_scheduled_gc_removes_old_orphans(app, client_for):
+    alice = client_for('alice')
+    path = _attachment(alice, _upload(alice).get_json()['id'])[0]
+    folder = app.config['UPLOAD_FOLDER']
+    orphan, fresh = os.path.join(folder, 'ab', 'cd', 'orphan'), os.path.join(folder, 'ab', 'cd', 'fresh')
+    os.makedirs(os.path.dirname(orphan), exist_ok=True)
+    for file_path in (orphan, fresh):
+        with open(file_path, 'wb') as f:
+            f.write(b'left behind')
+    old = time.time() - 2 * 3600
+    for file_path in (orphan, os.path.join(folder, path)):
+        os.utime(file_path, (old, old))
+
+    with app.app_context():
+        runner = JobRunner(app)
+        runner._schedule()
+    run_jobs(app)
+    assert not os.path.exists(orphan)
+    # Too new to be sure it is not an upload in progress
+    assert os.path.exists(fresh)
+    assert os.path.exists(os.path.join(folder, path))
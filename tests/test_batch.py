@@ -0,0 +1,69 @@
+import pytest
+from tests.conftest import add_transaction
+
+NEW = {'amount': '25.00', 'type': 'expense', 'category': '🚗 Transport', 'date': '2024-03-07'}
+
+def _batch(client, operations):
+    return client.post('/api/transactions/batch', json={'operations': operations})
+
+def _transactions(client):
+    return {t['id']: t for t in client.get('/api/transactions').get_json()['transactions']}
+
+def test_batch_applies_every_operation(client_for):
+    alice = client_for('alice')
+    keep, drop = add_transaction(alice), add_transaction(alice)
+    response = _batch(alice, [
+        {'op': 'create', 'data': NEW},
+        {'op': 'update', 'id': keep, 'data': {'amount': '11.00', 'description': 'lunch'}},
+        {'op': 'delete', 'id': drop},
+    ])
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [(result['index'], result['op']) for result in results] == [(0, 'create'), (1, 'update'), (2, 'delete')]
+
+    transactions = _transactions(alice)
+    assert set(transactions) == {keep, results[0]['id']}
+    # Fields left out of an update keep their values
+    assert (transactions[keep]['amount'], transactions[keep]['description'], transactions[keep]['category']) == \
+        (11.0, 'lunch', '🍔 Food & Dining')
+
+def test_one_bad_operation_rejects_the_batch(client_for):
+    alice, bob = client_for('alice'), client_for('bob')
+    mine, theirs = add_transaction(alice), add_transaction(bob)
+    response = _batch(alice, [
+        {'op': 'create', 'data': NEW},
+        {'op': 'delete', 'id': mine},
+        {'op': 'delete', 'id': theirs},
+    ])
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{'index': 2, 'error': 'Transaction not found'}]
+    # Nothing from the batch was applied
+    assert set(_transactions(alice)) == {mine}
+
+@pytest.mark.parametrize('operation, error', [
+    ('create', 'Operation must be an object'),
+    ({'op': 'create', 'data': ['x']}, 'data must be an object'),
+    ({'op': 'create', 'data': {**NEW, 'type': 1}}, 'type must be a string'),
+    ({'op': 'create', 'data': {**NEW, 'category': ['🚗 Transport']}}, 'category must be a string'),
+    ({'op': 'create', 'data': {**NEW, 'type': 'income'}}, 'Invalid category'),
+    ({'op': 'create', 'data': {**NEW, 'amount': '1.001'}}, 'Amount cannot have more than 2 decimal places'),
+    ({'op': 'update', 'id': '1', 'data': {}}, 'id must be an integer'),
+    ({'op': 'delete', 'id': True}, 'id must be an integer'),
+    ({'op': 'merge', 'id': 1}, 'Unknown operation: merge'),
+])
+def test_malformed_operations_get_per_index_errors(client_for, operation, error):
+    response = _batch(client_for('alice'), [{'op': 'create', 'data': NEW}, operation])
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{'index': 1, 'error': error}]
+
+def test_update_is_validated_against_the_stored_row(client_for):
+    alice = client_for('alice')
+    transaction_id = add_transaction(alice)
+    # The stored category is an expense one
+    response = _batch(alice, [{'op': 'update', 'id': transaction_id, 'data': {'type': 'income'}}])
+    assert response.get_json()['errors'] == [{'index': 0, 'error': 'Invalid category'}]
+
+@pytest.mark.parametrize('body', [{}, {'operations': []}, {'operations': {'op': 'create'}}])
+def test_operations_must_be_a_list(client_for, body):
+    response = client_for('alice').post('/api/transactions/batch', json=body)
+    assert response.status_code == 400
@@ -0,0 +1,47 @@
+from tests.conftest import add_transaction
+
+def _etag(client, path='/api/transactions'):
+    response = client.get(path)
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+def test_unchanged_data_answers_304(client_for):
+    alice = client_for('alice')
+    add_transaction(alice)
+    etag = _etag(alice)
+
+    response = alice.get('/api/transactions', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+def test_writes_change_the_etag(client_for):
+    alice = client_for('alice')
+    etag = _etag(alice)
+    add_transaction(alice)
+
+    response = alice.get('/api/transactions', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert len(response.get_json()['transactions']) == 1
+
+def test_other_users_writes_keep_the_etag(client_for):
+    alice, bob, admin = client_for('alice'), client_for('bob'), client_for('admin', 'admin')
+    alice_etag, admin_etag = _etag(alice), _etag(admin)
+    add_transaction(bob)
+
+    assert alice.get('/api/transactions', headers={'If-None-Match': alice_etag}).status_code == 304
+    # The admin's view covers every user
+    assert admin.get('/api/transactions', headers={'If-None-Match': admin_etag}).status_code == 200
+
+def test_category_changes_change_the_etag(client_for):
+    alice, admin = client_for('alice'), client_for('admin', 'admin')
+    etag = _etag(alice)
+    response = admin.post('/api/categories', json={'name': 'Pets', 'type': 'expense', 'icon': '🐶'})
+    assert response.status_code == 201
+    assert alice.get('/api/transactions', headers={'If-None-Match': etag}).status_code == 200
+
+def test_query_string_is_part_of_the_etag(client_for):
+    alice = client_for('alice')
+    assert _etag(alice) != _etag(alice, '/api/transactions?type=income')
@@ -0,0 +1,39 @@
+import threading
+import pytest
+from app.db import ConnectionPool
+
+@pytest.fixture
+def pool(tmp_path):
+    return ConnectionPool(str(tmp_path / 'pool.db'), max_idle=2)
+
+def test_released_connection_is_reused(pool):
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+
+def test_threads_do_not_share_connections(pool):
+    conn = pool.acquire()
+    pool.release(conn)
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.acquire()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+def test_open_transaction_is_rolled_back_on_release(pool):
+    conn = pool.acquire()
+    conn.execute('CREATE TABLE items (name TEXT)')
+    conn.commit()
+    conn.execute("INSERT INTO items VALUES ('a')")
+    pool.release(conn)
+    assert not conn.in_transaction
+    assert pool.acquire().execute('SELECT COUNT(*) FROM items').fetchone()[0] == 0
+
+def test_idle_connections_are_capped_and_expire(pool):
+    conns = [pool.acquire() for _ in range(3)]
+    for conn in conns:
+        pool.release(conn)
+    assert len(pool._idle()) == 2
+
+    pool.max_age = 0
+    assert pool.acquire() not in conns
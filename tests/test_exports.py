@@ -0,0 +1,102 @@
+import io
+import csv
+import json
+import datetime
+import pytest
+from tests.conftest import add_transaction, run_jobs
+
+def _export(client, **options):
+    response = client.post('/api/exports', json=options)
+    assert response.status_code == 202, response.get_json()
+    return response
+
+def test_export_runs_as_a_job(app, client_for):
+    admin = client_for('admin', role='admin')
+    add_transaction(admin, amount='10.50', description='lunch', date='2024-03-05')
+    add_transaction(admin, amount='2000', type='income', category='💼 Salary', date='2024-03-01')
+    add_transaction(admin, amount='3.00', date='2023-12-31')
+
+    response = _export(admin, start_date='2024-01-01')
+    assert response.get_json()['status'] == 'queued'
+    status_url = response.headers['Location']
+
+    run_jobs(app)
+    export = admin.get(status_url).get_json()
+    assert (export['status'], export['progress'], export['rows_written']) == ('done', 100, 2)
+
+    download = admin.get(export['download_url'])
+    assert download.status_code == 200
+    assert download.mimetype == 'text/csv'
+    rows = list(csv.reader(io.StringIO(download.get_data(as_text=True))))
+    assert rows == [
+        ['Date', 'User', 'Type', 'Category', 'Description', 'Amount'],
+        ['2024-03-05', 'admin', 'expense', '🍔 Food & Dining', 'lunch', '10.50'],
+        ['2024-03-01', 'admin', 'income', '💼 Salary', '', '2000.00'],
+    ]
+
+    # A broken download resumes where it stopped
+    partial = admin.get(export['download_url'], headers={'Range': 'bytes=10-'})
+    assert partial.status_code == 206
+    assert partial.data == download.data[10:]
+
+def test_exports_are_private_to_admins_and_their_owner(app, client_for):
+    admin, other = client_for('admin', role='admin'), client_for('other', role='admin')
+    status_url = _export(admin).headers['Location']
+    run_jobs(app)
+    download_url = admin.get(status_url).get_json()['download_url']
+
+    assert other.get(status_url).status_code == 404
+    assert other.get(download_url).status_code == 404
+    assert client_for('alice').post('/api/exports', json={}).status_code == 403
+
+def test_export_filters_are_checked_up_front(client_for):
+    admin = client_for('admin', role='admin')
+    response = admin.post('/api/exports', json={'start_date': '05/03/2024'})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def _download(app, client, export_format):
+    status_url = _export(client, format=export_format).headers['Location']
+    run_jobs(app)
+    export = client.get(status_url).get_json()
+    assert export['status'] == 'done', export
+    return client.get(export['download_url'])
+
+@pytest.fixture
+def admin(client_for):
+    admin = client_for('admin', role='admin')
+    add_transaction(admin, amount='10.50', description='lunch', date='2024-03-05')
+    add_transaction(admin, amount='2000', type='income', category='💼 Salary', date='2024-03-01')
+    return admin
+
+def test_jsonl_export_has_typed_values(app, admin):
+    response = _download(app, admin, 'jsonl')
+    assert response.mimetype == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [(record['type'], record['category'], record['description'], record['amount'])
+            for record in records] == [('expense', '🍔 Food & Dining', 'lunch', 10.5),
+                                       ('income', '💼 Salary', '', 2000.0)]
+    assert records[0]['user'] == 'admin'
+
+@pytest.mark.parametrize('export_format', ['parquet', 'arrow'])
+def test_columnar_exports_keep_their_schema(app, admin, export_format):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+
+    data = _download(app, admin, export_format).data
+    if export_format == 'parquet':
+        table = pq.read_table(io.BytesIO(data))
+    else:
+        table = pa.ipc.open_file(pa.BufferReader(data)).read_all()
+
+    assert table.schema.field('date').type == pa.date32()
+    assert table.schema.field('amount').type == pa.float64()
+    assert pa.types.is_dictionary(table.schema.field('category').type)
+    assert table.column('date').to_pylist() == [datetime.date(2024, 3, 5), datetime.date(2024, 3, 1)]
+    assert table.column('amount').to_pylist() == [10.5, 2000.0]
+    assert table.column('category').to_pylist() == ['🍔 Food & Dining', '💼 Salary']
+
+def test_unknown_export_format_is_rejected(client_for):
+    response = client_for('admin', role='admin').post('/api/exports', json={'format': 'xlsx'})
+    assert response.status_code == 400
+    assert 'csv' in response.get_json()['error']
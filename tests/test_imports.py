@@ -0,0 +1,94 @@
+import io
+import json
+import sqlite3
+import pytest
+from app.routes import imports
+
+CSV = '''Date,Narration,Debit,Kind
+05/03/2024,Coffee,-120.50,
+06/03/2024,Salary,50000,
+07/03/2024,Broken,abc,
+08/03/2024,Fuel,-900,
+'''
+
+OFX = '''<OFX><BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20240305120000[+5:30:IST]
+<TRNAMT>-42.00
+<NAME>Bus pass
+</STMTTRN>
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20240306
+<TRNAMT>1500.00
+<MEMO>Refund
+</STMTTRN>
+</BANKTRANLIST></OFX>
+'''
+
+def _import(client, content, filename='statement.csv', **form):
+    form = {'expense_category': '🍔 Food & Dining', 'income_category': '💼 Salary', **form}
+    return client.post('/api/transactions/import', content_type='multipart/form-data',
+                       data={'file': (io.BytesIO(content.encode('utf-8')), filename), **form})
+
+def _transactions(client):
+    return client.get('/api/transactions').get_json()['transactions']
+
+def test_csv_import_with_mapping(client_for):
+    alice = client_for('alice')
+    response = _import(alice, CSV, mapping=json.dumps({'amount': 'Debit', 'description': 'Narration'}),
+                       date_format='%d/%m/%Y')
+    assert response.status_code == 201
+    result = response.get_json()
+    assert (result['imported'], result['error_count']) == (3, 1)
+    assert result['errors'] == [{'row': 4, 'error': 'Invalid amount: abc'}]
+
+    rows = {(t['date'], t['description'], t['type'], t['amount'], t['category']) for t in _transactions(alice)}
+    assert rows == {('2024-03-05', 'Coffee', 'expense', 120.5, '🍔 Food & Dining'),
+                    ('2024-03-06', 'Salary', 'income', 50000.0, '💼 Salary'),
+                    ('2024-03-08', 'Fuel', 'expense', 900.0, '🍔 Food & Dining')}
+
+def test_ofx_import(client_for):
+    alice = client_for('alice')
+    response = _import(alice, OFX, filename='statement.ofx')
+    assert response.get_json()['imported'] == 2
+    rows = {(t['date'], t['description'], t['type'], t['amount']) for t in _transactions(alice)}
+    assert rows == {('2024-03-05', 'Bus pass', 'expense', 42.0), ('2024-03-06', 'Refund', 'income', 1500.0)}
+
+def test_import_spools_many_batches(client_for, monkeypatch):
+    monkeypatch.setattr(imports, 'IMPORT_BATCH_SIZE', 2)
+    monkeypatch.setattr(imports, 'IMPORT_SPOOL_MEMORY', 64)
+    alice = client_for('alice')
+    lines = ''.join(f'2024-03-{day:02d},-{day}.00\n' for day in range(1, 8))
+    assert _import(alice, 'date,amount\n' + lines).get_json()['imported'] == 7
+    assert len(_transactions(alice)) == 7
+
+def test_failed_import_leaves_nothing(client_for, monkeypatch):
+    insert = imports._insert_spooled
+
+    def _fail_after_inserting(conn, spool):
+        insert(conn, spool)
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(imports, 'IMPORT_BATCH_SIZE', 2)
+    monkeypatch.setattr(imports, '_insert_spooled', _fail_after_inserting)
+    alice = client_for('alice')
+    lines = ''.join(f'2024-03-{day:02d},-{day}.00\n' for day in range(1, 6))
+    response = _import(alice, 'date,amount\n' + lines)
+    assert response.status_code == 500
+    assert response.get_json() == {'error': 'Import failed, nothing was imported: disk I/O error'}
+    assert _transactions(alice) == []
+
+@pytest.mark.parametrize('mapping', ['[1, 2]', '{"amount": 3}', 'not json'])
+def test_invalid_mapping_is_rejected(client_for, mapping):
+    response = _import(client_for('alice'), CSV, mapping=mapping)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid mapping'}
+
+def test_unreadable_file_is_rejected(client_for):
+    alice = client_for('alice')
+    response = alice.post('/api/transactions/import', content_type='multipart/form-data',
+                          data={'file': (io.BytesIO(b'date,amount\n\xff\xfe,1\n'), 'statement.csv')})
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('Could not read file')
@@ -0,0 +1,125 @@
+import time
+import threading
+from app import jobs
+from app.jobs import JobRunner, MAX_RETRY_DELAY, _retry_or_fail, enqueue, get_job, job
+from app.db import get_db
+from app.writer import run_write
+
+calls = []
+
+@job(name='tests.record', max_attempts=20)
+def record(value):
+    calls.append(value)
+    return value
+
+@job(name='tests.flaky', retry_delay=0.01)
+def flaky(failures):
+    calls.append('flaky')
+    if calls.count('flaky') <= failures:
+        raise RuntimeError('not yet')
+    return 'ok'
+
+@job(name='tests.broken', max_attempts=2, retry_delay=0.01)
+def broken():
+    raise RuntimeError('broken')
+
+def _runner(app, worker_id):
+    runner = JobRunner(app, lease=60)
+    runner.worker_id = worker_id
+    return runner
+
+def _expire_lease(job_id):
+    run_write(lambda conn: conn.execute('UPDATE jobs SET locked_until = ? WHERE id = ?',
+                                        (time.time() - 1, job_id)))
+
+def test_expired_lease_is_reclaimed(app):
+    with app.app_context():
+        job_id = record.enqueue('a')
+        dead, live = _runner(app, 'dead'), _runner(app, 'live')
+        assert [row[0] for row in dead._claim(1)] == [job_id]
+
+        # Held until the lease runs out
+        assert live._claim(1) == []
+        _expire_lease(job_id)
+        assert [row[0] for row in live._claim(1)] == [job_id]
+
+        row = get_job(job_id)
+        assert (row['status'], row['locked_by'], row['attempts']) == ('running', 'live', 2)
+
+        # A late report from the worker that lost the lease changes nothing
+        run_write(lambda conn: _retry_or_fail(conn, job_id, 'dead', 10, RuntimeError('late')))
+        row = get_job(job_id)
+        assert (row['status'], row['locked_by'], row['error']) == ('running', 'live', None)
+
+def test_expired_lease_out_of_attempts_fails(app):
+    with app.app_context():
+        job_id = broken.enqueue()
+        runner = _runner(app, 'dead')
+        for _ in range(2):
+            assert [row[0] for row in runner._claim(1)] == [job_id]
+            _expire_lease(job_id)
+
+        assert runner._claim(1) == []
+        row = get_job(job_id)
+        assert (row['status'], row['error'], row['locked_by']) == ('failed', 'Lease expired', None)
+
+def test_retry_backs_off_exponentially(app, monkeypatch):
+    # No jitter: the delay is exactly retry_delay * 2 ** (attempts - 1)
+    monkeypatch.setattr(jobs.random, 'random', lambda: 0.5)
+    with app.app_context():
+        job_id = enqueue('tests.record', ('a',))
+        runner = _runner(app, 'w')
+        for attempts, expected in [(1, 10), (2, 20), (4, 80), (15, MAX_RETRY_DELAY)]:
+            runner._claim(1)
+            run_write(lambda conn: conn.execute('UPDATE jobs SET attempts = ?, run_at = 0 WHERE id = ?',
+                                                (attempts, job_id)))
+            run_write(lambda conn: _retry_or_fail(conn, job_id, 'w', 10, RuntimeError('failed')))
+            row = get_job(job_id)
+            assert (row['status'], row['error'], row['locked_by']) == ('queued', 'failed', None)
+            assert round(row['run_at'] - row['updated_at'], 3) == expected
+            # Make it due again for the next claim
+            run_write(lambda conn: conn.execute('UPDATE jobs SET run_at = 0 WHERE id = ?', (job_id,)))
+
+def test_runner_retries_then_gives_up(app):
+    calls.clear()
+    runner = JobRunner(app, threads=2, poll_interval=0.01)
+    stop = threading.Event()
+    thread = threading.Thread(target=runner.run, args=(stop,))
+    thread.start()
+    try:
+        with app.app_context():
+            flaky_id = flaky.enqueue(2)
+            broken_id = broken.enqueue()
+            runner.wake()
+
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline:
+                rows = [get_job(flaky_id), get_job(broken_id)]
+                if all(row['status'] in ('done', 'failed') for row in rows):
+                    break
+                time.sleep(0.02)
+    finally:
+        stop.set()
+        runner.wake()
+        thread.join()
+
+    flaky_row, broken_row = rows
+    assert (flaky_row['status'], flaky_row['attempts'], flaky_row['result'], flaky_row['error']) == \
+        ('done', 3, '"ok"', None)
+    assert (broken_row['status'], broken_row['attempts'], broken_row['error']) == ('failed', 2, 'broken')
+    assert calls == ['flaky'] * 3
+
+def test_periodic_job_is_queued_once_per_interval(app):
+    jobs.every(app, 3600, 'tests.record', args=['tick'])
+    with app.app_context():
+        runners = [_runner(app, 'a'), _runner(app, 'b')]
+        for runner in runners:
+            runner._schedule()
+        queued = get_db().execute("SELECT id, created_at FROM jobs WHERE name = 'tests.record'").fetchall()
+        assert len(queued) == 1
+
+        # Due again once the last run is an interval old
+        run_write(lambda conn: conn.execute('UPDATE jobs SET created_at = created_at - 3600'))
+        for runner in runners:
+            runner._schedule()
+        assert get_db().execute("SELECT COUNT(*) FROM jobs WHERE name = 'tests.record'").fetchone()[0] == 2
@@ -0,0 +1,110 @@
+import sqlite3
+import pytest
+from app.db import (SCHEMA_VERSION, UNREADABLE_DATE_DAY, UNREADABLE_DATE_MONTH, _migration_base_schema,
+                    get_db, migrate_db, rebuild_transaction_summary)
+from tests.conftest import login
+
+# Rows as the app stored them before versioned migrations: REAL amounts,
+# category names, and dates in whatever form the client sent
+BASELINE_TRANSACTIONS = [
+    # (amount, type, category, date, attachment_path)
+    (12.5, 'expense', '🍔 Food & Dining', '2024-03-05', 'receipt.txt'),
+    (0.1 + 0.2, 'expense', '🍔 Food & Dining', '2024/03/07', None),
+    (19.99, 'expense', 'Pets', '07-03-2024', 'receipt.txt'),
+    (50000.0, 'income', '💼 Salary', '2024-02-29 09:30:00', None),
+    (7.0, 'expense', '🚗 Transport', 'sometime in march', None),
+    (3.25, 'expense', '🚗 Transport', '2024-02-30', None),
+]
+
+def _write_baseline(path):
+    conn = sqlite3.connect(path)
+    _migration_base_schema(conn)
+    conn.execute("INSERT INTO users (username, password, role) VALUES ('alice', 'x', 'user')")
+    conn.executemany('INSERT INTO categories (name, type, icon) VALUES (?, ?, ?)',
+                     [('🍔 Food & Dining', 'expense', '🍔'), ('🚗 Transport', 'expense', '🚗'),
+                      ('💼 Salary', 'income', '💼')])
+    conn.executemany('''INSERT INTO transactions (user_id, username, amount, type, category, date,
+                                                  attachment_filename, attachment_path)
+                        VALUES (1, 'alice', ?, ?, ?, ?, ?, ?)''',
+                     [(amount, type_, category, date, path and 'receipt.txt', path)
+                      for amount, type_, category, date, path in BASELINE_TRANSACTIONS])
+    conn.commit()
+    conn.close()
+
+@pytest.fixture
+def migrated(make_app, tmp_path):
+    """App started on a database the baseline schema wrote"""
+    _write_baseline(str(tmp_path / 'expenses.db'))
+    (tmp_path / 'uploads').mkdir()
+    (tmp_path / 'uploads' / 'receipt.txt').write_bytes(b'receipt')
+    # Migrations run as the app starts
+    return make_app()
+
+def _rows(app, query):
+    with app.app_context():
+        return [tuple(row) for row in get_db().execute(query)]
+
+def test_baseline_database_migrates(migrated):
+    with migrated.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+        assert migrate_db(db) == []
+    assert _rows(migrated, 'SELECT COUNT(*) FROM transactions') == [(len(BASELINE_TRANSACTIONS),)]
+
+def test_new_database_migrates(make_app):
+    app = make_app()
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+        assert migrate_db(db) == []
+
+def test_migrated_summary_matches_transactions(migrated):
+    summary = sorted(_rows(migrated, 'SELECT * FROM transaction_summary'))
+    assert summary
+    with migrated.app_context():
+        db = get_db()
+        rebuild_transaction_summary(db)
+        assert sorted(tuple(row) for row in db.execute('SELECT * FROM transaction_summary')) == summary
+        db.rollback()
+
+def test_amounts_become_paise(migrated):
+    assert _rows(migrated, 'SELECT amount FROM transactions ORDER BY id') == \
+        [(1250,), (30,), (1999,), (5000000,), (700,), (325,)]
+
+def test_categories_become_ids(migrated):
+    names = _rows(migrated, '''SELECT c.name FROM transactions t JOIN categories c ON c.id = t.category_id
+                               ORDER BY t.id''')
+    assert [name for (name,) in names] == ['🍔 Food & Dining', '🍔 Food & Dining', 'Pets',
+                                           '💼 Salary', '🚗 Transport', '🚗 Transport']
+    # A name never in the categories table gets a row of its own
+    assert _rows(migrated, "SELECT type FROM categories WHERE name = 'Pets'") == [('expense',)]
+
+def test_legacy_dates_become_days(migrated):
+    rows = _rows(migrated, 'SELECT date, day, month FROM transactions ORDER BY id')
+    assert rows[:4] == [('2024-03-05', 19787, 202403), ('2024-03-07', 19789, 202403),
+                        ('2024-03-07', 19789, 202403), ('2024-02-29', 19782, 202402)]
+    # Dates nothing can read keep their text but get the sentinel
+    assert rows[4:] == [('sometime in march', UNREADABLE_DATE_DAY, UNREADABLE_DATE_MONTH),
+                        ('2024-02-30', UNREADABLE_DATE_DAY, UNREADABLE_DATE_MONTH)]
+
+def test_pagination_reaches_migrated_rows(migrated):
+    client = migrated.test_client()
+    login(client, 1, 'alice')
+
+    seen, cursor = [], None
+    while True:
+        query = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+        page = client.get('/api/transactions', query_string=query).get_json()
+        seen.extend(transaction['id'] for transaction in page['transactions'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert sorted(seen) == list(range(1, len(BASELINE_TRANSACTIONS) + 1))
+    assert len(seen) == len(set(seen))
+
+def test_attachment_refs_are_counted(migrated):
+    assert _rows(migrated, 'SELECT path, refcount FROM attachment_refs') == [('receipt.txt', 2)]
+
+def test_attachment_sizes_are_recorded(migrated):
+    assert _rows(migrated, 'SELECT attachment_size FROM transactions ORDER BY id') == \
+        [(7,), (None,), (7,), (None,), (None,), (None,)]
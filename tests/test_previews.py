@@ -0,0 +1,45 @@
+import os
+import signal
+import time
+import pytest
+from app.previews import PREVIEW_SIZE, PreviewPool, preview_path, render_preview
+
+Image = pytest.importorskip('PIL.Image')
+
+def _photo(path, color=(200, 100, 50)):
+    Image.new('RGB', (1600, 1200), color).save(path, 'JPEG')
+    return str(path)
+
+def _wait_for(predicate, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def test_render_preview_downscales(tmp_path):
+    source = _photo(tmp_path / 'photo')
+    assert render_preview(source, preview_path(source), 'jpeg')
+    with Image.open(preview_path(source)) as preview:
+        assert preview.format == 'JPEG'
+        assert preview.size[0] <= PREVIEW_SIZE[0] and preview.size[1] <= PREVIEW_SIZE[1]
+
+def test_pool_replaces_a_dead_renderer(tmp_path):
+    pool = PreviewPool()
+    first, second = _photo(tmp_path / 'first'), _photo(tmp_path / 'second', (0, 0, 0))
+    try:
+        pool.submit(first, 'jpeg')
+        assert _wait_for(lambda: os.path.exists(preview_path(first)))
+
+        # Kill the renderer the way the OOM killer would
+        executor = pool._executor.get()
+        for process in executor._processes.values():
+            os.kill(process.pid, signal.SIGKILL)
+        assert _wait_for(lambda: executor._broken)
+
+        pool.submit(second, 'jpeg')
+        assert _wait_for(lambda: os.path.exists(preview_path(second)))
+        assert pool._executor.get() is not executor
+    finally:
+        pool._executor.get().shutdown()
@@ -0,0 +1,35 @@
+import os
+import pytest
+from app.process_local import ProcessLocal
+
+def test_value_is_built_once():
+    built = []
+    value = ProcessLocal(lambda: built.append(1) or len(built))
+    assert value.get() == value.get() == 1
+    assert built == [1]
+
+def test_replace_only_swaps_the_current_value():
+    value = ProcessLocal(object)
+    old = value.get()
+    new = object()
+    assert value.replace(old, new) is new
+    # A second caller still holding old loses to the first
+    assert value.replace(old, object()) is new
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_value_is_rebuilt_after_fork():
+    value = ProcessLocal(lambda: os.getpid())
+    assert value.get() == os.getpid()
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write, str(value.get()).encode())
+        os._exit(0)
+    os.close(write)
+    child = int(os.read(read, 32))
+    os.close(read)
+    os.waitpid(pid, 0)
+
+    assert child == pid
+    assert value.get() == os.getpid()
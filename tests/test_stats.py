@@ -0,0 +1,26 @@
+from tests.conftest import add_transaction
+
+def test_stats_are_scoped_to_the_caller(client_for):
+    alice, bob = client_for('alice'), client_for('bob')
+    add_transaction(alice, amount='10.00')
+    add_transaction(bob, amount='99.00')
+
+    stats = alice.get('/api/stats', query_string={'user_id': bob.user_id}).get_json()
+    assert (stats['total_expenses'], stats['transaction_count']) == (10.0, 1)
+
+def test_admin_stats_for_one_user_or_everyone(client_for):
+    admin, alice, bob = client_for('admin', 'admin'), client_for('alice'), client_for('bob')
+    add_transaction(alice, amount='10.00')
+    add_transaction(bob, amount='99.00', date='2024-04-01')
+
+    assert admin.get('/api/stats').get_json()['total_expenses'] == 109.0
+    stats = admin.get('/api/stats', query_string={'user_id': alice.user_id}).get_json()
+    assert stats['total_expenses'] == 10.0
+    stats = admin.get('/api/stats', query_string={'start_date': '2024-04-01'}).get_json()
+    assert stats['total_expenses'] == 99.0
+
+def test_malformed_user_id_is_rejected(client_for):
+    admin = client_for('admin', 'admin')
+    response = admin.get('/api/stats', query_string={'user_id': 'abc'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid user_id: abc'}
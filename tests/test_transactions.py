@@ -0,0 +1,38 @@
+import pytest
+from tests.conftest import add_transaction
+
+VALID = {'amount': '12.50', 'type': 'expense', 'category': '🚗 Transport', 'date': '2024-03-06'}
+
+def test_update_changes_the_transaction(client_for):
+    alice = client_for('alice')
+    transaction_id = add_transaction(alice)
+    assert alice.put(f'/api/transactions/{transaction_id}', json=VALID).status_code == 200
+
+    [transaction] = alice.get('/api/transactions').get_json()['transactions']
+    assert (transaction['amount'], transaction['category'], transaction['date']) == \
+        (12.5, '🚗 Transport', '2024-03-06')
+
+@pytest.mark.parametrize('change, error', [
+    ({'type': None}, 'Missing required fields'),
+    ({'category': ''}, 'Missing required fields'),
+    ({'type': 'transfer'}, 'Type must be income or expense'),
+    ({'type': 'income'}, 'Invalid category'),
+    ({'amount': '-1'}, 'Amount must be greater than zero'),
+    ({'date': '2024-02-30'}, 'Invalid date: 2024-02-30'),
+])
+def test_update_rejects_invalid_fields(client_for, change, error):
+    alice = client_for('alice')
+    transaction_id = add_transaction(alice)
+    response = alice.put(f'/api/transactions/{transaction_id}', json={**VALID, **change})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
+
+def test_update_without_type_leaves_the_row(client_for):
+    alice = client_for('alice')
+    transaction_id = add_transaction(alice)
+    fields = dict(VALID)
+    del fields['type']
+    assert alice.put(f'/api/transactions/{transaction_id}', json=fields).status_code == 400
+
+    [transaction] = alice.get('/api/transactions').get_json()['transactions']
+    assert (transaction['type'], transaction['amount']) == ('expense', 10.0)
@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+import time
+import pytest
+from app.writer import GroupCommitWriter
+
+@pytest.fixture
+def writer(tmp_path):
+    database = str(tmp_path / 'writer.db')
+    conn = sqlite3.connect(database)
+    conn.execute('CREATE TABLE items (name TEXT UNIQUE NOT NULL)')
+    conn.close()
+    return GroupCommitWriter(database, max_wait=0.05)
+
+def _names(writer):
+    conn = sqlite3.connect(writer.database)
+    try:
+        return sorted(name for (name,) in conn.execute('SELECT name FROM items'))
+    finally:
+        conn.close()
+
+def _insert(name):
+    return lambda conn: conn.execute('INSERT INTO items (name) VALUES (?)', (name,)).lastrowid
+
+def _hold(writer):
+    """Occupy the writer thread until the returned event is set"""
+    started, release = threading.Event(), threading.Event()
+
+    def _block(conn):
+        started.set()
+        release.wait(5)
+
+    thread = threading.Thread(target=writer.submit, args=(_block,))
+    thread.start()
+    started.wait(5)
+    return release, thread
+
+def _submit_all(writer, fns, timeout=30):
+    outcomes = [None] * len(fns)
+
+    def _submit(index, fn):
+        try:
+            outcomes[index] = writer.submit(fn, timeout=timeout)
+        except Exception as e:
+            outcomes[index] = e
+
+    threads = [threading.Thread(target=_submit, args=item) for item in enumerate(fns)]
+    for thread in threads:
+        thread.start()
+    return outcomes, threads
+
+def test_failed_write_only_undoes_itself(writer):
+    # Queue everything behind a held group so it commits as one
+    release, holder = _hold(writer)
+    outcomes, threads = _submit_all(writer, [_insert('a'), _insert('a'), _insert('b')])
+    time.sleep(0.1)
+    release.set()
+    for thread in threads + [holder]:
+        thread.join()
+
+    assert isinstance(outcomes[1], sqlite3.IntegrityError)
+    assert outcomes[0] == 1 and outcomes[2] == 2
+    assert _names(writer) == ['a', 'b']
+
+def test_timeout_drops_queued_write(writer):
+    release, holder = _hold(writer)
+    outcomes, threads = _submit_all(writer, [_insert('late')], timeout=0.05)
+    threads[0].join()
+    release.set()
+    holder.join()
+
+    assert isinstance(outcomes[0], TimeoutError)
+    # The writer is free again and never ran the dropped write
+    assert writer.submit(_insert('next')) == 1
+    assert _names(writer) == ['next']
+
+def test_timeout_waits_for_running_write(writer):
+    def _slow(conn):
+        time.sleep(0.5)
+        return _insert('slow')(conn)
+
+    # Past the writer's collection wait, so _slow is running when it expires
+    assert writer.submit(_slow, timeout=0.2) == 1
+    assert _names(writer) == ['slow']
+
+def test_base_exception_goes_to_its_caller(writer):
+    def _exit(conn):
+        _insert('exit')(conn)
+        raise SystemExit(1)
+
+    with pytest.raises(SystemExit):
+        writer.submit(_exit)
+    # The writer thread survived it
+    assert writer.submit(_insert('next'), timeout=5) == 1
+    assert _names(writer) == ['next']
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_dead_writer_thread_is_replaced(writer):
+    writer.submit(_insert('a'))
+    work, thread = writer._writer.get()
+    # Stop it the way a crash would: from inside the thread
+    work.put((lambda conn: None, None))
+    thread.join(5)
+    assert not thread.is_alive()
+
+    assert writer.submit(_insert('b'), timeout=5) == 2
+    assert _names(writer) == ['a', 'b']